@@ -0,0 +1,311 @@
+"""Benchmark Dumper on synthetic payloads.
+
+Every case extracts a payload made of a single operation type (plus one
+with all of them mixed) with each of the given worker counts, in a fresh
+process so peak RSS and syscall counts belong to that run alone. Results go
+to a JSON file meant to be diffed between versions:
+
+    python benchmarks/bench.py -o before.json
+    git checkout ... && python benchmarks/bench.py -o after.json
+
+Syscalls are the read and write syscall counts of /proc/self/io (null where
+it does not exist); worker processes of --processes are not included.
+
+With --http the payloads are read through HttpFile from a local
+range_server, with the given latency and bandwidth, and the requests and
+bytes it served are recorded too.
+
+Every extracted image is checked against the hash the generator recorded:
+a case that extracts a wrong image is marked failed and makes the run exit
+with an error, as its numbers mean nothing.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing import cpu_count
+
+import synthetic
+from range_server import RangeServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def proc_io():
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+    except OSError:
+        return None
+    return int(fields["syscr"]), int(fields["syscw"])
+
+
+def peak_rss():
+    # VmHWM belongs to this process image alone, while ru_maxrss also counts
+    # the parent's memory at fork time. ru_maxrss is in KiB on Linux and in
+    # bytes on macOS.
+    rss = None
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    rss = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    scale = 1 if sys.platform == "darwin" else 1024
+    if rss is None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    # Worker processes of --processes
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return max(rss, children)
+
+
+def image_hash(path):
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(4 * 1024 * 1024):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def run_child(config):
+    """Extract one payload in this process and print the measurements."""
+    sys.path.insert(0, os.path.join(ROOT, "src"))
+    from payload_dumper.dumper import Dumper
+    from payload_dumper.http_file import HttpFile
+
+    before = proc_io()
+    start = time.perf_counter()
+    if "url" in config:
+        payload = HttpFile(config["url"], connections=config["connections"])
+    else:
+        payload = open(config["payload"], "rb")
+    with payload:
+        dumper = Dumper(
+            payload,
+            config["out"],
+            diff=config["old"] is not None,
+            old=config["old"],
+            workers=config["workers"],
+            writer=config["writer"],
+            processes=config["processes"],
+        )
+        dumper.run()
+    seconds = time.perf_counter() - start
+    after = proc_io()
+
+    result = {"seconds": seconds, "peak_rss": peak_rss(), "failed": dumper.failed}
+    if before is not None and after is not None:
+        result["read_syscalls"] = after[0] - before[0]
+        result["write_syscalls"] = after[1] - before[1]
+    else:
+        result["read_syscalls"] = result["write_syscalls"] = None
+    # Checked after measuring, so it costs the run nothing
+    result["wrong_images"] = [
+        name
+        for name, expected in config["hashes"].items()
+        if image_hash(os.path.join(config["out"], name + ".img")) != expected
+    ]
+    print(json.dumps(result))
+
+
+def run_case(payload, summary, workers, args, server):
+    out = tempfile.mkdtemp(prefix="out-", dir=args.work_dir)
+    config = {
+        "payload": payload,
+        "out": out,
+        "old": summary["old"],
+        "workers": workers,
+        "writer": args.writer,
+        "processes": args.processes,
+        "hashes": summary["partitions"],
+    }
+    if server is not None:
+        config["url"] = server.url + os.path.relpath(payload, args.work_dir)
+        config["connections"] = args.http_connections
+        server.reset_stats()
+    try:
+        r = subprocess.run(
+            [sys.executable, __file__, "--child", json.dumps(config)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    finally:
+        shutil.rmtree(out)
+    result = json.loads(r.stdout.strip().splitlines()[-1])
+    result["ok"] = not result["failed"] and not result["wrong_images"]
+    ops = sum(summary["operations"].values())
+    syscalls = None
+    if result["read_syscalls"] is not None:
+        syscalls = result["read_syscalls"] + result["write_syscalls"]
+    result.update(
+        {
+            "workers": workers,
+            "operations": ops,
+            "image_bytes": summary["image_size"],
+            "data_bytes": summary["data_size"],
+            "mb_per_s": summary["image_size"] / result["seconds"] / 1024**2,
+            "ops_per_s": ops / result["seconds"],
+            "syscalls_per_op": syscalls / ops if syscalls is not None else None,
+        }
+    )
+    if server is not None:
+        stats = server.stats()
+        result["http_requests"] = stats["requests"]
+        result["http_bytes"] = stats["bytes_sent"]
+    return result
+
+
+def git_commit():
+    try:
+        r = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        )
+    except OSError:
+        return None
+    return r.stdout.strip() or None
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        run_child(json.loads(sys.argv[2]))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark payload extraction")
+    parser.add_argument(
+        "-o", "--output", default="bench.json", help="result file (default: bench.json)"
+    )
+    parser.add_argument(
+        "--size",
+        type=synthetic.parse_size,
+        default="64M",
+        help="partition size of every payload (default: 64M)",
+    )
+    parser.add_argument(
+        "--ops",
+        default=",".join(synthetic.OP_TYPES + ("mixed",)),
+        help="comma separated cases: operation types and/or 'mixed' (default: all)",
+    )
+    parser.add_argument(
+        "--workers",
+        default=",".join(str(n) for n in sorted({1, 4, cpu_count()})),
+        help="comma separated worker counts (default: %(default)s)",
+    )
+    parser.add_argument("--block-size", type=int, default=synthetic.DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--op-blocks", type=int, default=synthetic.DEFAULT_OP_BLOCKS)
+    parser.add_argument("--writer", choices=["pwrite", "mmap"], default="pwrite")
+    parser.add_argument("-P", "--processes", action="store_true")
+    parser.add_argument(
+        "--zip", action="store_true", help="extract from a zip instead of payload.bin"
+    )
+    parser.add_argument(
+        "--work-dir", default=None, help="where payloads and images are written"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--http", action="store_true", help="read payloads from a local range server"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="--http latency per request (s)"
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=synthetic.parse_size,
+        default=None,
+        help="--http bytes per second, e.g. 50M (default: unlimited)",
+    )
+    parser.add_argument(
+        "--http-connections",
+        type=int,
+        default=4,
+        help="HttpFile connections with --http (default: 4)",
+    )
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="payload-bench-", dir=args.work_dir)
+    args.work_dir = work_dir
+    server = None
+    if args.http:
+        server = RangeServer(work_dir, latency=args.latency, bandwidth=args.bandwidth)
+        server.start()
+    results = []
+    try:
+        for case in args.ops.split(","):
+            if case == "mixed":
+                mix = dict.fromkeys(synthetic.OP_TYPES, 1)
+            else:
+                mix = synthetic.parse_mix(case)
+            case_dir = os.path.join(work_dir, case)
+            os.makedirs(case_dir)
+            diff = any(name in synthetic.DIFF_OP_TYPES for name in mix)
+            old = os.path.join(case_dir, "old") if diff else None
+            summary = synthetic.generate(
+                os.path.join(case_dir, "payload.bin"),
+                {"system": args.size},
+                mix,
+                block_size=args.block_size,
+                op_blocks=args.op_blocks,
+                old_dir=old,
+                zip_path=os.path.join(case_dir, "ota.zip") if args.zip else None,
+                seed=args.seed,
+            )
+            summary["old"] = old
+            for workers in (int(n) for n in args.workers.split(",")):
+                result = run_case(summary["path"], summary, workers, args, server)
+                result["case"] = case
+                results.append(result)
+                print(
+                    f"{case:14} workers={workers:<3} {result['mb_per_s']:8.1f} MB/s"
+                    f" {result['peak_rss'] / 1024**2:7.1f} MB RSS"
+                    + ("" if result["ok"] else "  FAILED: wrong output")
+                )
+            shutil.rmtree(case_dir)
+    finally:
+        if server is not None:
+            server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": cpu_count(),
+        "config": {
+            "size": args.size,
+            "block_size": args.block_size,
+            "op_blocks": args.op_blocks,
+            "writer": args.writer,
+            "processes": args.processes,
+            "zip": args.zip,
+            "seed": args.seed,
+            "http": args.http,
+            "latency": args.latency,
+            "bandwidth": args.bandwidth,
+            "http_connections": args.http_connections,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+    if not all(result["ok"] for result in results):
+        sys.exit("Some cases extracted wrong images")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""Local HTTP server for range requests, with configurable network conditions.
+
+Stands in for a CDN so HttpFile request patterns can be measured offline and
+reproducibly. Every request can be delayed by a fixed latency, the total
+bandwidth capped, the number of responses sent at once limited, range
+support switched off, and every Nth response cut off halfway with a TCP
+reset. Files are served from a directory, with an ETag per file version.
+"""
+
+import argparse
+import os
+import re
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import synthetic
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Throttle:
+    """Token bucket shared by all connections, bytes per second."""
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.next = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n: int) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.next = max(self.next, now) + n / self.rate
+            delay = self.next - now
+        time.sleep(delay)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _file(self):
+        path = os.path.normpath(self.path.split("?", 1)[0].lstrip("/"))
+        if path.startswith(".."):
+            return None
+        path = os.path.join(self.server.root, path)
+        return path if os.path.isfile(path) else None
+
+    def _headers(self, path):
+        st = os.stat(path)
+        self.send_header("ETag", '"%x-%x"' % (st.st_size, st.st_mtime_ns))
+        if self.server.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        return st.st_size
+
+    def _not_found(self):
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        path = self._file()
+        if path is None:
+            return self._not_found()
+        self.server.delay()
+        self.send_response(200)
+        size = self._headers(path)
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+
+    def do_GET(self):
+        path = self._file()
+        if path is None:
+            return self._not_found()
+        with self.server.slots:
+            reset = self.server.count_request()
+            self.server.delay()
+            self.send_response_for(path, reset)
+
+    def send_response_for(self, path, reset):
+        size = os.path.getsize(path)
+        m = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if m and self.server.accept_ranges and int(m[1]) < size:
+            start = int(m[1])
+            end = min(int(m[2]), size - 1) if m[2] else size - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            start, end = 0, size - 1
+            self.send_response(200)
+        self._headers(path)
+        length = end - start + 1
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+        # A reset response stops halfway through its body
+        left = length // 2 if reset else length
+        with open(path, "rb") as f:
+            f.seek(start)
+            while left > 0:
+                chunk = f.read(min(CHUNK_SIZE, left))
+                if not chunk:
+                    break
+                if self.server.throttle is not None:
+                    self.server.throttle.consume(len(chunk))
+                self.wfile.write(chunk)
+                self.server.count_bytes(len(chunk))
+                left -= len(chunk)
+        if reset:
+            self.wfile.flush()
+            # Linger 0 turns the close into a RST
+            self.connection.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)
+            )
+            self.close_connection = True
+
+
+class RangeServer(ThreadingHTTPServer):
+    """Serve the files in root on host:port (0 picks a free port).
+
+    latency is added to every request in seconds, bandwidth caps the bytes
+    per second of all responses together, max_connections limits how many
+    responses are sent at once (further requests wait their turn). With
+    accept_ranges off, the Accept-Ranges header is left out and Range headers
+    ignored. With reset_every=N, every Nth GET is reset halfway through.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        root,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        bandwidth=None,
+        max_connections=None,
+        accept_ranges=True,
+        reset_every=None,
+        verbose=False,
+    ):
+        super().__init__((host, port), RangeHandler)
+        self.root = root
+        self.latency = latency
+        self.throttle = Throttle(bandwidth) if bandwidth else None
+        self.slots = threading.BoundedSemaphore(max_connections or 1 << 30)
+        self.accept_ranges = accept_ranges
+        self.reset_every = reset_every
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.thread = None
+        self.reset_stats()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.resets = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "bytes_sent": self.bytes_sent,
+                "resets": self.resets,
+            }
+
+    def count_request(self) -> bool:
+        # Returns whether this request gets reset
+        with self.lock:
+            self.requests += 1
+            reset = bool(self.reset_every) and self.requests % self.reset_every == 0
+            if reset:
+                self.resets += 1
+            return reset
+
+    def count_bytes(self, n: int) -> None:
+        with self.lock:
+            self.bytes_sent += n
+
+    def delay(self) -> None:
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def start(self) -> "RangeServer":
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve files with range requests")
+    parser.add_argument("root", help="directory to serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every request"
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=synthetic.parse_size,
+        default=None,
+        help="total bytes per second, e.g. 20M (default: unlimited)",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=None,
+        help="responses sent at once, further requests wait (default: unlimited)",
+    )
+    parser.add_argument(
+        "--no-accept-ranges",
+        action="store_true",
+        help="leave out Accept-Ranges and answer every GET with the whole file",
+    )
+    parser.add_argument(
+        "--reset-every",
+        type=int,
+        default=None,
+        help="reset every Nth response halfway through its body",
+    )
+    args = parser.parse_args()
+
+    server = RangeServer(
+        args.root,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        max_connections=args.max_connections,
+        accept_ranges=not args.no_accept_ranges,
+        reset_every=args.reset_every,
+        verbose=True,
+    )
+    print(f"Serving {args.root} at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(server.stats())
+
+
+if __name__ == "__main__":
+    main()
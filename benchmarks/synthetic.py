@@ -0,0 +1,290 @@
+"""Write synthetic CrAU payloads for benchmarking.
+
+The payloads are valid version 2 payloads with a configurable mix of
+operation types, partition sizes and block size, optionally wrapped in an
+OTA-style zip. Differential operations read from old images written next to
+the payload. Everything is derived from a seed, so the same arguments always
+produce the same payload.
+"""
+
+import argparse
+import bz2
+import hashlib
+import lzma
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import zipfile
+
+import bsdiff4
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from payload_dumper import update_metadata_pb2 as um  # noqa: E402
+
+OP_TYPES = (
+    "REPLACE",
+    "REPLACE_XZ",
+    "REPLACE_BZ",
+    "ZERO",
+    "SOURCE_COPY",
+    "SOURCE_BSDIFF",
+)
+DIFF_OP_TYPES = ("SOURCE_COPY", "SOURCE_BSDIFF")
+
+DEFAULT_BLOCK_SIZE = 4096
+DEFAULT_OP_BLOCKS = 256
+
+
+def random_bytes(rnd, n):
+    if n == 0:
+        return b""
+    return rnd.getrandbits(n * 8).to_bytes(n, "little")
+
+
+def new_content(rnd, size):
+    # Half random, half zeros: compresses about as well as real images
+    half = size // 2
+    return random_bytes(rnd, half) + bytes(size - half)
+
+
+def patched(rnd, src):
+    # A new version of src with a few bytes changed in every block
+    data = bytearray(src)
+    for offset in range(0, len(data), 4096):
+        pos = offset + rnd.randrange(min(4096, len(data) - offset))
+        data[pos : pos + 16] = random_bytes(rnd, len(data[pos : pos + 16]))
+    return bytes(data)
+
+
+def set_extent(ext, start, count):
+    ext.start_block = start
+    ext.num_blocks = count
+
+
+def add_extent(extents, start, count):
+    set_extent(extents.add(), start, count)
+
+
+def generate(
+    path,
+    partitions,
+    op_mix,
+    block_size=DEFAULT_BLOCK_SIZE,
+    op_blocks=DEFAULT_OP_BLOCKS,
+    old_dir=None,
+    zip_path=None,
+    seed=0,
+    verity=(),
+):
+    """Write a payload to path and return a summary of it.
+
+    partitions maps partition names to sizes in bytes (rounded down to whole
+    blocks), op_mix maps operation type names to relative weights. Every
+    operation covers up to op_blocks blocks. Old images for differential
+    operations are written to old_dir, which is required when op_mix has
+    any. With zip_path, the payload is also stored in a zip there.
+
+    Partitions named in verity end with a hash tree and FEC area that no
+    operation writes, as on a device computing them after the update: their
+    manifest hash covers that area, the summary hash the extracted image.
+    """
+    rnd = random.Random(seed)
+    types = [name for name in op_mix if op_mix[name] > 0]
+    weights = [op_mix[name] for name in types]
+    if any(name in DIFF_OP_TYPES for name in types) and old_dir is None:
+        raise ValueError("differential operations need an old image directory")
+
+    dam = um.DeltaArchiveManifest()
+    dam.block_size = block_size
+    counts = dict.fromkeys(types, 0)
+    hashes = {}
+    blobs = tempfile.TemporaryFile()
+    blobs_size = 0
+    for name, size in partitions.items():
+        part = dam.partitions.add()
+        part.partition_name = name
+        nblocks = size // block_size
+        old = None
+        if old_dir is not None:
+            os.makedirs(old_dir, exist_ok=True)
+            old = random_bytes(rnd, nblocks * block_size)
+            with open(os.path.join(old_dir, name + ".img"), "wb") as f:
+                f.write(old)
+
+        data_blocks = nblocks
+        if name in verity:
+            tree_blocks = max(1, nblocks // 64)
+            fec_blocks = max(1, nblocks // 128)
+            data_blocks = nblocks - tree_blocks - fec_blocks
+            set_extent(part.hash_tree_data_extent, 0, data_blocks)
+            set_extent(part.hash_tree_extent, data_blocks, tree_blocks)
+            set_extent(part.fec_data_extent, 0, data_blocks + tree_blocks)
+            set_extent(part.fec_extent, data_blocks + tree_blocks, fec_blocks)
+
+        image_hash = hashlib.sha256()
+        block = 0
+        while block < data_blocks:
+            count = min(op_blocks, data_blocks - block)
+            length = count * block_size
+            kind = rnd.choices(types, weights)[0]
+            counts[kind] += 1
+            op = part.operations.add()
+            op.type = getattr(um.InstallOperation, kind)
+            if kind in DIFF_OP_TYPES:
+                # A source range split in two extents, landing in two extents
+                src = rnd.randrange(nblocks - count + 1)
+                first = max(1, count // 2)
+                add_extent(op.src_extents, src, first)
+                if count > first:
+                    add_extent(op.src_extents, src + first, count - first)
+                src_data = old[src * block_size : (src + count) * block_size]
+            if kind in DIFF_OP_TYPES or kind == "ZERO":
+                half = max(1, count // 2)
+                add_extent(op.dst_extents, block, half)
+                if count > half:
+                    add_extent(op.dst_extents, block + half, count - half)
+            else:
+                add_extent(op.dst_extents, block, count)
+
+            data = b""
+            if kind == "ZERO":
+                content = bytes(length)
+            elif kind == "SOURCE_COPY":
+                content = src_data
+            elif kind == "SOURCE_BSDIFF":
+                content = patched(rnd, src_data)
+                data = bsdiff4.diff(src_data, content)
+            else:
+                content = new_content(rnd, length)
+                if kind == "REPLACE":
+                    data = content
+                elif kind == "REPLACE_XZ":
+                    data = lzma.compress(content, preset=1)
+                else:
+                    data = bz2.compress(content)
+            image_hash.update(content)
+
+            if data:
+                op.data_offset = blobs_size
+                op.data_length = len(data)
+                op.data_sha256_hash = hashlib.sha256(data).digest()
+                blobs.write(data)
+                blobs_size += len(data)
+            block += count
+
+        part.new_partition_info.size = nblocks * block_size
+        device_hash = image_hash.copy()
+        if data_blocks < nblocks:
+            tail = (nblocks - data_blocks) * block_size
+            image_hash.update(bytes(tail))
+            device_hash.update(random_bytes(rnd, tail))
+        part.new_partition_info.hash = device_hash.digest()
+        hashes[name] = image_hash.hexdigest()
+
+    manifest = dam.SerializeToString()
+    with open(path, "wb") as f:
+        f.write(b"CrAU" + struct.pack(">QQI", 2, len(manifest), 0))
+        f.write(manifest)
+        blobs.seek(0)
+        shutil.copyfileobj(blobs, f)
+    blobs.close()
+
+    if zip_path is not None:
+        with zipfile.ZipFile(zip_path, "w") as z:
+            z.writestr("META-INF/com/android/metadata", "ota-type=AB\n")
+            z.write(path, "payload.bin", compress_type=zipfile.ZIP_STORED)
+
+    return {
+        "path": zip_path or path,
+        "block_size": block_size,
+        "partitions": hashes,
+        "operations": counts,
+        "data_size": blobs_size,
+        "image_size": sum(part.new_partition_info.size for part in dam.partitions),
+    }
+
+
+def parse_size(value):
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    if value[-1:].upper() in units:
+        return int(value[:-1]) * units[value[-1:].upper()]
+    return int(value)
+
+
+def parse_mix(value):
+    # "REPLACE=3,ZERO=1" or "REPLACE,ZERO" for equal weights
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip().upper()
+        if name not in OP_TYPES:
+            raise argparse.ArgumentTypeError(f"unknown operation type {name}")
+        mix[name] = float(weight) if weight else 1.0
+    return mix
+
+
+def parse_partitions(value):
+    # "system=256M,vendor=64M"
+    partitions = {}
+    for item in value.split(","):
+        name, _, size = item.partition("=")
+        partitions[name] = parse_size(size)
+    return partitions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic OTA payload")
+    parser.add_argument("out", help="directory to write payload.bin (and old/) to")
+    parser.add_argument(
+        "--partitions",
+        type=parse_partitions,
+        default="system=64M",
+        help="comma separated name=size list (default: system=64M)",
+    )
+    parser.add_argument(
+        "--ops",
+        type=parse_mix,
+        default=",".join(OP_TYPES),
+        help="comma separated operation types, each optionally =weight "
+        "(default: all types, equal weights)",
+    )
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument(
+        "--op-blocks",
+        type=int,
+        default=DEFAULT_OP_BLOCKS,
+        help="blocks per operation (default: %d)" % DEFAULT_OP_BLOCKS,
+    )
+    parser.add_argument(
+        "--verity",
+        type=lambda value: value.split(","),
+        default=(),
+        help="comma separated partitions ending with a hash tree and FEC area",
+    )
+    parser.add_argument("--zip", action="store_true", help="also write ota.zip")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    diff = any(name in DIFF_OP_TYPES for name in args.ops)
+    summary = generate(
+        os.path.join(args.out, "payload.bin"),
+        args.partitions,
+        args.ops,
+        block_size=args.block_size,
+        op_blocks=args.op_blocks,
+        old_dir=os.path.join(args.out, "old") if diff else None,
+        zip_path=os.path.join(args.out, "ota.zip") if args.zip else None,
+        seed=args.seed,
+        verity=args.verity,
+    )
+    for key, value in summary.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,27 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
 import os
 from multiprocessing import cpu_count
 
 from . import http_file
+from .async_dumper import AsyncDumper
+from .async_http import AsyncHttpFile
+from .block_cache import DEFAULT_CACHE_SIZE, BlockCache
 from .dumper import Dumper
+from .manifest_cache import ManifestCache, default_directory
+from .range_planner import DEFAULT_MAX_GAP
+
+
+async def extract_async(url, args, options):
+    async with AsyncHttpFile(url, args.http_connections, args.http_chunk_size) as f:
+        dumper = AsyncDumper(f, args.out, **options)
+        await dumper.open()
+        if not (args.list or args.plan):
+            await dumper.extract()
+    print("\ntotal bytes read from network:", f.total_bytes)
+    return 1 if dumper.failed else 0
+
 
 def main():
     parser = argparse.ArgumentParser(description="OTA payload dumper")
@@ -43,35 +60,165 @@ def main():
         action="store_true",
         help="list partitions in the payload file",
     )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="estimate download size, requests and disk usage of the selected "
+        "partitions and save it to plan.json, without extracting",
+    )
     parser.add_argument(
         "-m",
         "--metadata",
         action="store_true",
         help="extract and display metadata file from the payload",
     )
+    parser.add_argument(
+        "--writer",
+        choices=["pwrite", "mmap"],
+        default="pwrite",
+        help="how decoded data is written to the output images (default: pwrite)",
+    )
+    parser.add_argument(
+        "--http-connections",
+        default=http_file.DEFAULT_CONNECTIONS,
+        type=int,
+        help="parallel connections used for large reads from a URL (default: %d)"
+        % http_file.DEFAULT_CONNECTIONS,
+    )
+    parser.add_argument(
+        "--http-chunk-size",
+        default=http_file.DEFAULT_CHUNK_SIZE,
+        type=int,
+        help="size in bytes of each parallel range request (default: %d)"
+        % http_file.DEFAULT_CHUNK_SIZE,
+    )
+    parser.add_argument(
+        "--coalesce-gap",
+        default=DEFAULT_MAX_GAP,
+        type=int,
+        help="merge data ranges of a URL payload that are at most this many bytes "
+        "apart into one request, -1 to disable (default: %d)" % DEFAULT_MAX_GAP,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="cache data read from a URL in this directory (default: no cache)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        default=DEFAULT_CACHE_SIZE,
+        type=int,
+        help="maximum size in bytes of the --cache-dir cache (default: %d)"
+        % DEFAULT_CACHE_SIZE,
+    )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        help="resume an interrupted extraction into the same output directory",
+    )
+    parser.add_argument(
+        "--verify",
+        choices=["off", "fail", "refetch"],
+        default="fail",
+        help="check operation data hashes and fail the partition or refetch "
+        "the data on a mismatch (default: fail)",
+    )
+    parser.add_argument(
+        "-P",
+        "--processes",
+        action="store_true",
+        help="run operations in worker processes instead of threads, for "
+        "differential OTAs heavy in SOURCE_BSDIFF",
+    )
+    parser.add_argument(
+        "--manifest-cache-dir",
+        default=default_directory(),
+        help="cache payload manifests in this directory so repeated runs on the "
+        "same file skip reading them (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-manifest-cache",
+        action="store_true",
+        help="always read the manifest from the payload",
+    )
+    parser.add_argument(
+        "--trace",
+        default=None,
+        metavar="FILE",
+        help="save a timeline of reads, decoding and writes of every operation "
+        "to FILE, in Chrome trace format (for chrome://tracing or Perfetto)",
+    )
+    parser.add_argument(
+        "--report",
+        default=None,
+        metavar="FILE",
+        help="save per-partition timings, throughput, operation counts, HTTP "
+        "and cache statistics and peak memory use to FILE as JSON",
+    )
+    parser.add_argument(
+        "--async",
+        dest="async_engine",
+        action="store_true",
+        help="fetch a URL with asyncio instead of threads; --http-connections "
+        "then limits the range requests in flight",
+    )
     args = parser.parse_args()
+    is_url = args.payloadfile.startswith(("http://", "https://"))
+    if args.async_engine and not is_url:
+        parser.error("--async only reads URLs")
+    if args.async_engine and (args.metadata or args.processes or args.cache_dir):
+        parser.error("--async can't be combined with -m, -P or --cache-dir")
 
     # Check for --out directory exists
     if not os.path.exists(args.out):
         os.makedirs(args.out)
 
+    options = dict(
+        diff=args.diff,
+        old=args.old,
+        images=args.partitions,
+        workers=args.workers,
+        list_partitions=args.list,
+        writer=args.writer,
+        coalesce_gap=args.coalesce_gap,
+        resume=args.resume,
+        verify=args.verify,
+        plan=args.plan,
+        manifest_cache=(
+            None if args.no_manifest_cache else ManifestCache(args.manifest_cache_dir)
+        ),
+        trace=args.trace,
+        report=args.report,
+    )
+    if args.async_engine:
+        return asyncio.run(extract_async(args.payloadfile, args, options))
+
     payload_file = args.payloadfile
-    if payload_file.startswith("http://") or payload_file.startswith("https://"):
-        payload_file = http_file.HttpFile(payload_file)
+    if is_url:
+        payload_file = http_file.HttpFile(
+            payload_file,
+            connections=args.http_connections,
+            chunk_size=args.http_chunk_size,
+            cache=(
+                BlockCache(args.cache_dir, args.cache_size) if args.cache_dir else None
+            ),
+        )
+        if args.cache_dir and payload_file.cache is None:
+            print("Remote has no ETag or Last-Modified header, not caching it")
     else:
         payload_file = open(payload_file, "rb")
 
     dumper = Dumper(
         payload_file,
         args.out,
-        diff=args.diff,
-        old=args.old,
-        images=args.partitions,
-        workers=args.workers,
-        list_partitions=args.list,
         extract_metadata=args.metadata,
+        processes=args.processes,
+        **options,
     )
     dumper.run()
 
     if isinstance(payload_file, http_file.HttpFile):
         print("\ntotal bytes read from network:", payload_file.total_bytes)
+    # Non-zero if any partition failed, e.g. on a hash mismatch
+    return 1 if dumper.failed else 0
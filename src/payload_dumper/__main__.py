@@ -1,4 +1,6 @@
 #!/usr/bin/env python3
+import sys
+
 from . import main
 
-main()
+sys.exit(main())
@@ -0,0 +1,244 @@
+import asyncio
+import collections
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import zipfile
+from .async_http import DEFAULT_MAX_REQUESTS, AsyncHttpFile, SyncReader
+from .dumper import Dumper, u32, u64
+from .http_file import DEFAULT_CHUNK_SIZE
+from .scheduler import schedule
+
+DEFAULT_BUFFER_SIZE = 256 * 1024 * 1024
+
+
+class ByteBudget:
+    """Bounds the bytes of fetched operation data held at once.
+
+    A request larger than the whole budget is let through once nothing else
+    is held, so a single large span can't stall the pipeline.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.cond = asyncio.Condition()
+
+    async def acquire(self, n: int) -> None:
+        async with self.cond:
+            await self.cond.wait_for(
+                lambda: self.used == 0 or self.used + n <= self.limit
+            )
+            self.used += n
+
+    async def release(self, n: int) -> None:
+        async with self.cond:
+            self.used -= n
+            self.cond.notify_all()
+
+
+class AsyncDumper(Dumper):
+    """Extracts a remote payload with asyncio.
+
+    Operation data is fetched through an AsyncHttpFile, so the number of range
+    requests in flight is bounded by its max_requests rather than by a thread
+    each, and by buffer_size bytes of fetched data waiting to be decoded.
+    Decoding and writing run on a pool of `workers` threads. Partition state,
+    resume journal, hashing and reports are the same as Dumper's.
+
+        async with AsyncHttpFile(url, max_requests=64) as payload:
+            dumper = AsyncDumper(payload, "out", images="boot,init_boot")
+            await dumper.open()
+            results = await dumper.extract()  # {"boot": True, ...}
+
+    start() instead returns a future per partition, each resolved with
+    whether the partition was extracted correctly as soon as it is closed.
+    """
+
+    def __init__(self, payloadfile, out, buffer_size=DEFAULT_BUFFER_SIZE, **kwargs):
+        if kwargs.get("processes") or kwargs.get("extract_metadata"):
+            raise ValueError("processes and extract_metadata need Dumper")
+        self.buffer_size = buffer_size
+        super().__init__(payloadfile, out, **kwargs)
+        # Operations are always fetched by span; with a negative gap every
+        # operation simply gets a span of its own
+        self.coalesce = True
+        self.mode = "async"
+        self.loop = None
+        self.executor = None
+        self.task = None
+        self.futures = {}
+        self.closing = []
+
+    def load(self):
+        # The metadata is read asynchronously, by open()
+        pass
+
+    async def open(self):
+        if not self.load_cached_manifest():
+            await self.read_metadata_async()
+            self.save_cached_manifest()
+
+        if self.list_partitions:
+            self.list_partitions_info()
+        elif self.plan:
+            self.plan_partitions()
+
+    async def read_metadata_async(self):
+        head = await self.source.read_at(0, 24)
+        if head[:4] != b"CrAU":
+            # zipfile is synchronous: let it find payload.bin on another thread
+            loop = asyncio.get_running_loop()
+            self.payload_base = await loop.run_in_executor(
+                None, self.find_payload_member, loop
+            )
+            head = await self.source.read_at(self.payload_base, 24)
+        if head[:4] != b"CrAU" or u64(head[4:12]) != 2:
+            raise ValueError("not a version 2 payload")
+        manifest_size = u64(head[12:20])
+        signature_size = u32(head[20:24])
+        rest = await self.source.read_at(
+            self.payload_base + 24, manifest_size + signature_size
+        )
+        self.load_manifest(
+            rest[:manifest_size],
+            rest[manifest_size:],
+            24 + manifest_size + signature_size,
+        )
+
+    def find_payload_member(self, loop):
+        with zipfile.ZipFile(SyncReader(self.source, loop)) as zip_file:
+            info = zip_file.getinfo("payload.bin")
+            if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+                raise ValueError("payload.bin is compressed, use Dumper")
+            with zip_file.open(info) as member:
+                return member._orig_compress_start
+
+    def read_payload(self, offset, length, refetch=False):
+        # Only called from the decoding threads, to refetch operation data;
+        # AsyncHttpFile has no cache to bypass
+        return asyncio.run_coroutine_threadsafe(
+            self.read_payload_async(offset, length), self.loop
+        ).result()
+
+    async def read_payload_async(self, offset, length):
+        with self.tracer.span("read", "io", offset=offset, bytes_in=length):
+            return await self.source.read_at(self.payload_base + offset, length)
+
+    def start(self):
+        """Start extracting the selected partitions and return a future per
+        partition name. Must be called from a running event loop."""
+        self.loop = asyncio.get_running_loop()
+        parts = [
+            {"partition": partition, "operations": partition.operations}
+            for partition in self.selected_partitions()
+        ]
+        self.futures = {
+            part["partition"].partition_name: self.loop.create_future() for part in parts
+        }
+        self.task = self.loop.create_task(self.run_async(parts))
+        return dict(self.futures)
+
+    async def extract(self):
+        """Extract the selected partitions, returning whether each succeeded."""
+        futures = self.start()
+        await self.task
+        return {name: future.result() for name, future in futures.items()}
+
+    async def run_async(self, parts):
+        started = time.monotonic()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        if self.verify != "off":
+            self.hash_pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            opened = self.open_parts(parts)
+            queue = schedule(opened, self.block_size, self.plan_spans(opened))
+            pending = collections.deque(self.span_groups(queue))
+            budget = ByteBudget(self.buffer_size)
+            # Enough consumers to keep every request slot and worker busy
+            consumers = self.source.max_requests + self.workers
+            await asyncio.gather(
+                *(self.consume(pending, budget) for _ in range(consumers))
+            )
+            await asyncio.gather(*self.closing)
+        except BaseException:
+            self.failed = True
+            raise
+        finally:
+            if self.journal is not None:
+                self.journal.close(remove=not self.failed)
+            self.executor.shutdown()
+            if self.hash_pool is not None:
+                self.hash_pool.shutdown()
+                self.hash_pool = None
+            if self.trace:
+                self.tracer.save(self.trace)
+            if self.report:
+                self.write_report(parts, time.monotonic() - started)
+            for future in self.futures.values():
+                # Not opened, or interrupted
+                if not future.done():
+                    future.set_result(False)
+            self.manager.stop()
+
+    async def consume(self, pending, budget):
+        while pending:
+            span, items = pending.popleft()
+            size = 0 if span is None else len(span)
+            await budget.acquire(size)
+            try:
+                if span is not None:
+                    # dump_op takes each operation's slice through Span.read
+                    span.data = await self.read_payload_async(span.start, size)
+                results = await asyncio.gather(
+                    *(
+                        self.loop.run_in_executor(self.executor, self.dump_op, part, op)
+                        for part, op in items
+                    ),
+                    return_exceptions=True,
+                )
+            except Exception as exc:
+                if span is not None:
+                    span.data = None
+                results = [exc] * len(items)
+            finally:
+                await budget.release(size)
+            for (part, op), result in zip(items, results):
+                exc = result if isinstance(result, BaseException) else None
+                self.complete_op(part, op, exc)
+
+    def finish_part(self, part):
+        # Closing hashes the rest of the image, which may read it back: keep
+        # that off the event loop
+        future = self.loop.run_in_executor(self.executor, super().finish_part, part)
+        name = part["partition"].partition_name
+
+        def done(future):
+            if not self.futures[name].done():
+                ok = future.exception() is None and not part["failed"]
+                self.futures[name].set_result(ok)
+
+        future.add_done_callback(done)
+        self.closing.append(future)
+
+
+async def extract(
+    url,
+    out,
+    max_requests=DEFAULT_MAX_REQUESTS,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    **kwargs,
+):
+    """Extract the partitions of the payload or OTA zip at url into out.
+
+    Other keyword arguments are passed to AsyncDumper. Returns whether each
+    partition was extracted correctly, by name.
+    """
+    os.makedirs(out, exist_ok=True)
+    async with AsyncHttpFile(url, max_requests, chunk_size) as payload:
+        dumper = AsyncDumper(payload, out, **kwargs)
+        await dumper.open()
+        if dumper.list_partitions or dumper.plan:
+            return {}
+        return await dumper.extract()
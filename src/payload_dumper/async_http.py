@@ -0,0 +1,151 @@
+import asyncio
+import io
+import threading
+
+import httpx
+
+from .http_file import DEFAULT_CHUNK_SIZE, MAX_RETRIES, STATS
+
+DEFAULT_MAX_REQUESTS = 16
+
+
+class AsyncHttpFile:
+    """Positionless async reader of a remote file, using HTTP range requests.
+
+    At most max_requests range requests are in flight at any time, however many
+    reads are waiting. Reads larger than chunk_size are split into sub-ranges
+    fetched concurrently. Keeps the same counters as HttpFile (see stats()).
+    Use as an async context manager, or call open() and aclose().
+    """
+
+    def __init__(
+        self,
+        url: str,
+        max_requests: int = DEFAULT_MAX_REQUESTS,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        self.url = url
+        self.max_requests = max_requests
+        self.chunk_size = chunk_size
+        self.client = None
+        self.semaphore = None
+        self.size = 0
+        self.etag = ""
+        self.total_bytes = 0
+        self.requests = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # stats() may be called from other threads
+        self.lock = threading.Lock()
+
+    async def open(self) -> None:
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max(self.max_requests, 1))
+        )
+        self.semaphore = asyncio.Semaphore(max(self.max_requests, 1))
+        h = await self.client.head(self.url)
+        if h.headers.get("Accept-Ranges", "none") != "bytes":
+            await self.aclose()
+            raise ValueError("remote does not support ranges!")
+        self.size = int(h.headers.get("Content-Length", 0))
+        if self.size == 0:
+            await self.aclose()
+            raise ValueError("remote has no length!")
+        self.etag = h.headers.get("ETag") or h.headers.get("Last-Modified", "")
+
+    async def aclose(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {name: getattr(self, name) for name in STATS}
+
+    async def _fetch(self, start: int, view) -> None:
+        end_pos = start + len(view) - 1
+        n = 0
+        retries = 0
+        async with self.semaphore:
+            while True:
+                headers = {"Range": f"bytes={start + n}-{end_pos}"}
+                with self.lock:
+                    self.requests += 1
+                try:
+                    async with self.client.stream("GET", self.url, headers=headers) as r:
+                        if r.status_code != 206:
+                            raise io.UnsupportedOperation(
+                                "Remote did not return partial content!"
+                            )
+                        async for chunk in r.aiter_bytes(64 * 1024):
+                            view[n : n + len(chunk)] = chunk
+                            n += len(chunk)
+                    break
+                except httpx.TransportError:
+                    # As in HttpFile: request what is still missing
+                    retries += 1
+                    if retries > MAX_RETRIES:
+                        raise
+                    with self.lock:
+                        self.retries += 1
+        assert n == len(view)
+        with self.lock:
+            self.total_bytes += n
+
+    async def read_at(self, offset: int, size: int) -> bytes:
+        size = max(min(size, self.size - offset), 0)
+        buf = bytearray(size)
+        view = memoryview(buf)
+        await asyncio.gather(
+            *(
+                self._fetch(offset + off, view[off : off + self.chunk_size])
+                for off in range(0, size, self.chunk_size)
+            )
+        )
+        return bytes(buf)
+
+
+class SyncReader(io.RawIOBase):
+    """Blocking file object over an AsyncHttpFile, for use from a thread other
+    than the event loop's (e.g. to let zipfile find payload.bin)."""
+
+    def __init__(self, file: AsyncHttpFile, loop):
+        self.file = file
+        self.loop = loop
+        self.pos = 0
+
+    def seekable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.file.size
+        self.pos = offset
+        return offset
+
+    def tell(self) -> int:
+        return self.pos
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        return asyncio.run_coroutine_threadsafe(
+            self.file.read_at(offset, size), self.loop
+        ).result()
+
+    def readinto(self, buffer) -> int:
+        data = self.read_at(self.pos, len(buffer))
+        buffer[: len(data)] = data
+        self.pos += len(data)
+        return len(data)
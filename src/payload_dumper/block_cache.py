@@ -0,0 +1,105 @@
+import hashlib
+import os
+import tempfile
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DEFAULT_CACHE_SIZE = 4 * 1024 * 1024 * 1024
+
+
+class BlockCache:
+    """On-disk cache of fixed-size, aligned blocks of remote files.
+
+    Every block is a file of its own under a directory per remote identity
+    (URL plus ETag/Content-Length); HttpFile doesn't cache remote files that
+    have no ETag or Last-Modified. Blocks are written to a temporary file and
+    renamed into place, so any number of processes can share one cache
+    directory: a reader sees either a complete block or none. The block's
+    mtime is its LRU timestamp; hits touch it, and the least recently used
+    blocks are removed once the cache grows past max_size.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_size: int = DEFAULT_CACHE_SIZE,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ):
+        self.directory = directory
+        self.max_size = max_size
+        self.block_size = block_size
+        self.added = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, url: str, etag: str, length: int) -> str:
+        ident = f"{url}\n{etag}\n{length}\n{self.block_size}"
+        return hashlib.sha256(ident.encode()).hexdigest()
+
+    def _path(self, key: str, index: int) -> str:
+        return os.path.join(self.directory, key, str(index))
+
+    def get(self, key: str, index: int, length: int):
+        path = self._path(key, index)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        if len(data) != length:
+            return None
+        return data
+
+    def put(self, key: str, index: int, data) -> None:
+        directory = os.path.join(self.directory, key)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".")
+        except OSError:
+            # Caching is best effort: the block itself was read fine
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key, index))
+        except BaseException as exc:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            if isinstance(exc, OSError):
+                # e.g. a full disk
+                return
+            raise
+        self.added += len(data)
+        # Scanning the whole cache is not free, only do it every so often
+        if self.added > self.max_size // 8:
+            self.evict()
+
+    def evict(self) -> None:
+        self.added = 0
+        blocks = []
+        total = 0
+        for key in os.scandir(self.directory):
+            if not key.is_dir():
+                continue
+            for entry in os.scandir(key.path):
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                blocks.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        if total <= self.max_size:
+            return
+        blocks.sort()
+        for _, size, path in blocks:
+            try:
+                os.remove(path)
+            except OSError:
+                # Evicted by another process meanwhile
+                pass
+            total -= size
+            if total <= self.max_size:
+                break
@@ -1,21 +1,35 @@
 #!/usr/bin/env python
-import bz2
 import hashlib
-import io
 import json
-import lzma
 import os
 import struct
 import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; the report then has no peak RSS
+    resource = None
 from . import zipfile
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from multiprocessing import cpu_count
 
-import bsdiff4
 from enlighten import get_manager
 
 from . import http_file
 from . import update_metadata_pb2 as um
+from .image_file import WRITERS, ImageFile, pread
+from .journal import Journal
+from .operations import OperationDecoder
+from .process_pool import init_worker, run_task
+from .range_planner import DEFAULT_MAX_GAP, plan_ranges
+from .scheduler import schedule
+from .stream_hash import ReorderBudget, StreamHasher
+from .tracing import NULL_TRACER, Tracer
+
+SEEK_INDEX_INTERVAL = 16 * 1024 * 1024
 
 flatten = lambda l: [item for sublist in l for item in sublist]
 
@@ -28,6 +42,15 @@ def u64(x):
     return struct.unpack(">Q", x)[0]
 
 
+def readable_size(size):
+    if size >= 1024**3:
+        return f"{size / 1024**3:.1f}GB"
+    elif size >= 1024**2:
+        return f"{size / 1024**2:.1f}MB"
+    else:
+        return f"{size / 1024:.1f}KB"
+
+
 def verify_contiguous(exts):
     blocks = 0
     for ext in exts:
@@ -39,11 +62,31 @@ def verify_contiguous(exts):
     return True
 
 
-class Dumper:
+class Dumper(OperationDecoder):
     def __init__(
-        self, payloadfile, out, diff=None, old=None, images="", workers=cpu_count(), list_partitions=False, extract_metadata=False
+        self,
+        payloadfile,
+        out,
+        diff=None,
+        old=None,
+        images="",
+        workers=cpu_count(),
+        list_partitions=False,
+        extract_metadata=False,
+        writer="pwrite",
+        coalesce_gap=DEFAULT_MAX_GAP,
+        resume=False,
+        verify="fail",
+        processes=False,
+        plan=False,
+        manifest_cache=None,
+        trace=None,
+        report=None,
     ):
         self.payloadfile = payloadfile
+        # The file the payload lives in, and where in it the payload starts
+        self.source = payloadfile
+        self.payload_base = 0
         self.manager = get_manager()
         self.download_progress = None
         if isinstance(payloadfile, http_file.HttpFile):
@@ -55,37 +98,138 @@ class Dumper:
         self.workers = workers
         self.list_partitions = list_partitions
         self.extract_metadata = extract_metadata
-
+        self.plan = plan
+        self.writer = WRITERS[writer]
+        self.writer_name = writer
+        # Plain local files are read with pread, without taking read_lock
+        self.source_fd = None
+        if hasattr(os, "pread") and not isinstance(payloadfile, http_file.HttpFile):
+            try:
+                self.source_fd = payloadfile.fileno()
+            except (AttributeError, OSError):
+                pass
+        # Remote payloads fetch coalesced spans instead of one range per operation
+        self.coalesce = isinstance(payloadfile, http_file.HttpFile) and coalesce_gap >= 0
+        self.coalesce_gap = coalesce_gap
+        self.op_spans = {}
+        self.resume = resume
+        self.journal = None
+        self.verify = verify
+        self.hash_pool = None
+        self.reorder_budget = None
+        self.processes = processes
+        # How operations actually ran, for the report
+        self.mode = "threads"
+        self.failed = False
+        self.progress_bars = {}
+        self.read_lock = threading.Lock()
+        self.manifest_cache = manifest_cache
+        # --trace output file; spans are only recorded when it is set
+        self.trace = trace
+        self.tracer = Tracer() if trace else NULL_TRACER
+        # --report output file
+        self.report = report
+        self.manifest_cached = False
+        self.load()
+
+    def load(self):
         if self.extract_metadata:
             self.extract_and_display_metadata()
         else:
-            try:
-                self.parse_metadata()
-            except AssertionError:
-                # try zip
-                with zipfile.ZipFile(self.payloadfile, "r") as zip_file:
-                    self.payloadfile = zip_file.open("payload.bin", "r")
-                self.parse_metadata()
-                pass
+            if not self.load_cached_manifest():
+                self.read_metadata()
 
             if self.list_partitions:
                 self.list_partitions_info()
+            elif self.plan:
+                self.plan_partitions()
+
+    def load_cached_manifest(self):
+        cached = None
+        if self.manifest_cache is not None:
+            cached = self.manifest_cache.get(self.source)
+        if cached is None:
+            return False
+        self.manifest_cached = True
+        manifest, signature, self.payload_base, data_offset = cached
+        self.load_manifest(manifest, signature, data_offset - self.payload_base)
+        return True
+
+    def save_cached_manifest(self):
+        # A deflated payload.bin can only be read through the zip file, so
+        # there is no offset in the source to cache
+        if self.manifest_cache is not None and self.payload_base is not None:
+            self.manifest_cache.put(
+                self.source,
+                self.manifest,
+                self.metadata_signature,
+                self.payload_base,
+                self.payload_base + self.data_offset,
+            )
+
+    def read_metadata(self):
+        try:
+            self.parse_metadata()
+        except AssertionError:
+            # try zip
+            # A deflated payload.bin is read out of order: keep a seek
+            # index so reads don't restart decompression from the start
+            with zipfile.ZipFile(
+                self.payloadfile, "r", seek_index_interval=SEEK_INDEX_INTERVAL
+            ) as zip_file:
+                info = zip_file.getinfo("payload.bin")
+                self.payloadfile = zip_file.open(info, "r")
+            # payload.bin is almost always stored: then operation data is
+            # read straight from the zip file, bypassing ZipExtFile
+            self.payload_base = self.stored_member_offset(info)
+            self.parse_metadata()
+        self.save_cached_manifest()
 
     def update_download_progress(self, prog, total):
+        # Called under HttpFile's lock, with the total of all reads in flight
         if self.download_progress is None and prog != total:
             self.download_progress = self.manager.counter(
                 total=total, desc="download", unit="b", leave=False
             )
         if self.download_progress is not None:
+            self.download_progress.total = total
             self.download_progress.update(prog - self.download_progress.count)
             if prog == total:
                 self.download_progress.close()
                 self.download_progress = None
 
     def run(self):
-        if self.list_partitions or self.extract_metadata:
+        if self.list_partitions or self.extract_metadata or self.plan:
             return
 
+        partitions = self.selected_partitions()
+        if len(partitions) == 0:
+            print("Not operating on any partitions")
+            return 0
+
+        # Operation data is read lazily by the workers (see read_op_data), so at
+        # most one blob per worker is held in memory at any time.
+        partitions_with_ops = []
+        for partition in partitions:
+            partitions_with_ops.append(
+                {
+                    "partition": partition,
+                    "operations": partition.operations,
+                }
+            )
+
+        started = time.monotonic()
+        try:
+            self.multiprocess_partitions(partitions_with_ops)
+        finally:
+            self.payloadfile.close()
+            if self.trace:
+                self.tracer.save(self.trace)
+            if self.report:
+                self.write_report(partitions_with_ops, time.monotonic() - started)
+        self.manager.stop()
+
+    def selected_partitions(self):
         if self.images == "":
             partitions = self.dam.partitions
         else:
@@ -100,64 +244,218 @@ class Dumper:
                         break
                 if not found:
                     print("Partition %s not found in image" % image)
-
-        if len(partitions) == 0:
-            print("Not operating on any partitions")
-            return 0
-
-        partitions_with_ops = []
-        for partition in partitions:
-            operations = []
-            for operation in partition.operations:
-                self.payloadfile.seek(self.data_offset + operation.data_offset)
-                operations.append(
-                    {
-                        "operation": operation,
-                        "data": self.payloadfile.read(operation.data_length),
-                    }
-                )
-            partitions_with_ops.append(
-                {
-                    "partition": partition,
-                    "operations": operations,
-                }
-            )
-
-        self.payloadfile.close()
-
-        self.multiprocess_partitions(partitions_with_ops)
-        self.manager.stop()
+        return partitions
 
     def multiprocess_partitions(self, partitions):
-        progress_bars = {}
-
-        def update_progress(partition_name, count):
-            progress_bars[partition_name].update(count)
-
-        with ThreadPoolExecutor(max_workers=self.workers) as executor:
-            for part in partitions:
-                partition_name = part["partition"].partition_name
-                progress_bars[partition_name] = self.manager.counter(
-                    total=len(part["operations"]),
-                    desc=f"{partition_name}",
-                    unit="ops",
-                    leave=True,
-                )
-
-            futures = {
-                executor.submit(self.dump_part, part, update_progress): part
-                for part in partitions
+        opened = self.open_parts(partitions)
+        spans = self.plan_spans(opened)
+
+        # Every operation is its own task: operations write disjoint dst_extents,
+        # so a large partition is spread over all workers instead of one. Tasks
+        # from all partitions are queued together, in write order within each
+        # partition and the most expensive partition first.
+        queue = schedule(opened, self.block_size, spans)
+        config = self.process_config(opened) if self.processes else None
+        if self.processes and config is None:
+            print("Payload cannot be opened by worker processes, using threads")
+        self.mode = "threads" if config is None else "processes"
+        try:
+            if config is not None:
+                self.run_processes(queue, config)
+            else:
+                self.run_threads(queue)
+        finally:
+            self.journal.close(remove=not self.failed)
+
+    def open_parts(self, partitions):
+        # Completed operations are journaled so an interrupted run can be resumed
+        self.journal = Journal(self.out, self.manifest_hash)
+        if self.resume:
+            self.journal.load()
+        self.failed = False
+        self.progress_bars = {}
+        # Out-of-order writes buffered for hashing, across all partitions
+        self.reorder_budget = ReorderBudget()
+
+        opened = []
+        for part in partitions:
+            partition_name = part["partition"].partition_name
+            try:
+                self.open_part(part)
+            except Exception as exc:
+                print(f"{partition_name} - processing generated an exception: {exc}")
+                self.failed = True
+                continue
+
+            self.progress_bars[partition_name] = self.manager.counter(
+                total=len(part["partition"].operations),
+                count=len(part["partition"].operations) - part["remaining"],
+                desc=f"{partition_name}",
+                unit="ops",
+                leave=True,
+            )
+            if part["remaining"] == 0:
+                self.finish_part(part)
+                continue
+            opened.append(part)
+        self.journal.start()
+        return opened
+
+    def plan_spans(self, opened):
+        if not self.coalesce:
+            return []
+        spans = plan_ranges(
+            [(part, op) for part in opened for op in part["operations"]],
+            self.data_offset,
+            max_gap=self.coalesce_gap,
+        )
+        self.op_spans = {id(op): span for span in spans for _, op in span.items}
+        return spans
+
+    def run_threads(self, queue):
+        # Operation data hashes are checked on their own pool, alongside decoding
+        if self.verify != "off":
+            self.hash_pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {
+                    executor.submit(
+                        self.dump_op, part, op, time.monotonic_ns()
+                    ): [(part, op)]
+                    for part, op in queue
+                }
+                self.wait_for(futures)
+        finally:
+            if self.hash_pool is not None:
+                self.hash_pool.shutdown()
+                self.hash_pool = None
+
+    def span_groups(self, queue):
+        # Group the operations sharing a coalesced span, to fetch the span once;
+        # the queue already keeps them next to each other
+        groups = []
+        for part, op in queue:
+            span = self.op_spans.get(id(op))
+            if groups and span is not None and groups[-1][0] is span:
+                groups[-1][1].append((part, op))
+            else:
+                groups.append((span, [(part, op)]))
+        return groups
+
+    def run_processes(self, queue, config):
+        # Operations sharing a coalesced span go to one worker
+        with ProcessPoolExecutor(
+            max_workers=self.workers, initializer=init_worker, initargs=(config,)
+        ) as executor:
+            futures = {}
+            for span, items in self.span_groups(queue):
+                task = {
+                    "span": None if span is None else (span.start, len(span)),
+                    "ops": [
+                        (part["partition"].partition_name, op.SerializeToString())
+                        for part, op in items
+                    ],
+                }
+                futures[executor.submit(run_task, task)] = items
+            self.wait_for(futures, in_process=False)
+
+    def process_config(self, parts):
+        if self.payload_base is None:
+            return None
+        if isinstance(self.source, http_file.HttpFile):
+            cache = self.source.cache
+            source = {
+                "url": self.source.url,
+                "connections": self.source.connections,
+                "chunk_size": self.source.chunk_size,
+                "cache_dir": None if cache is None else cache.directory,
+                "cache_size": None if cache is None else cache.max_size,
             }
-
+        elif isinstance(getattr(self.source, "name", None), str):
+            source = {"path": os.path.abspath(self.source.name)}
+        else:
+            return None
+        return {
+            "source": source,
+            "base": self.payload_base,
+            "data_offset": self.data_offset,
+            "block_size": self.block_size,
+            "diff": self.diff,
+            "out": self.out,
+            "old": self.old,
+            "writer": self.writer_name,
+            "verify": self.verify,
+            "trace": self.tracer.enabled,
+            "fresh": {
+                part["partition"].partition_name
+                for part in parts
+                if part["out_file"].fresh
+            },
+        }
+
+    def wait_for(self, futures, in_process=True):
+        # Completion is tracked here, on a single thread, so no locking is
+        # needed for the per-partition counters or the journal.
+        try:
             for future in as_completed(futures):
-                part = futures[future]
-                partition_name = part["partition"].partition_name
                 try:
-                    future.result()
-                    progress_bars[partition_name].close()
-                except Exception as exc:
-                    print(f"{partition_name} - processing generated an exception: {exc}")
-                    progress_bars[partition_name].close()
+                    result = future.result()
+                    exc = None
+                except Exception as e:
+                    exc = e
+                else:
+                    if not in_process:
+                        self.task_done(futures[future], result)
+                for part, op in futures[future]:
+                    hasher = part["out_file"].hasher
+                    if exc is None and not in_process and hasher is not None:
+                        # Written by another process: the partition hash reads
+                        # these ranges back from the image
+                        for ext in op.dst_extents:
+                            hasher.written(
+                                ext.start_block * self.block_size,
+                                ext.num_blocks * self.block_size,
+                            )
+                    self.complete_op(part, op, exc)
+        except BaseException:
+            # Don't run the rest of the queue on Ctrl-C; the journal keeps
+            # what is done so far for --resume
+            self.failed = True
+            for future in futures:
+                future.cancel()
+            raise
+
+    def task_done(self, items, result):
+        # Result of process_pool.run_task
+        started = result["started"]
+        for part, _ in items:
+            part["started"] = min(part.get("started", started), started)
+        if isinstance(self.source, http_file.HttpFile):
+            self.source.add_stats(result["http"])
+        if result["trace"] is not None:
+            self.tracer.extend(*result["trace"])
+
+    def complete_op(self, part, op, exc):
+        partition_name = part["partition"].partition_name
+        if exc is None:
+            if not part["failed"]:
+                self.journal.record(partition_name, part["index"][id(op)])
+                self.progress_bars[partition_name].update(1)
+        else:
+            if not part["failed"]:
+                print(f"{partition_name} - processing generated an exception: {exc}")
+            part["failed"] = True
+            self.failed = True
+
+        part["remaining"] -= 1
+        if part["remaining"] == 0:
+            self.finish_part(part)
+
+    def finish_part(self, part):
+        part["finished"] = time.monotonic()
+        if not self.close_part(part):
+            self.failed = True
+        self.progress_bars[part["partition"].partition_name].close()
 
     def parse_metadata(self):
         head_len = 4 + 8 + 8 + 4
@@ -177,98 +475,225 @@ class Dumper:
             metadata_signature_size = u32(buffer[20:24])
 
         manifest = self.payloadfile.read(manifest_size)
-        self.metadata_signature = self.payloadfile.read(metadata_signature_size)
-        self.data_offset = self.payloadfile.tell()
+        metadata_signature = self.payloadfile.read(metadata_signature_size)
+        self.load_manifest(manifest, metadata_signature, self.payloadfile.tell())
+
+    def load_manifest(self, manifest, metadata_signature, data_offset):
+        self.manifest = manifest
+        self.manifest_hash = hashlib.sha256(manifest).hexdigest()
+        self.metadata_signature = metadata_signature
+        self.data_offset = data_offset
         self.dam = um.DeltaArchiveManifest()
         self.dam.ParseFromString(manifest)
         self.block_size = self.dam.block_size
 
-    def data_for_op(self, operation, out_file, old_file):
-        data = operation["data"]
-        op = operation["operation"]
-
-        # assert hashlib.sha256(data).digest() == op.data_sha256_hash, 'operation data hash mismatch'
-
-        if op.type == op.REPLACE_XZ:
-            dec = lzma.LZMADecompressor()
-            data = dec.decompress(data)
-            out_file.seek(op.dst_extents[0].start_block * self.block_size)
-            out_file.write(data)
-        elif op.type == op.REPLACE_BZ:
-            dec = bz2.BZ2Decompressor()
-            data = dec.decompress(data)
-            out_file.seek(op.dst_extents[0].start_block * self.block_size)
-            out_file.write(data)
-        elif op.type == op.REPLACE:
-            out_file.seek(op.dst_extents[0].start_block * self.block_size)
-            out_file.write(data)
-        elif op.type == op.SOURCE_COPY:
-            if not self.diff:
-                print("SOURCE_COPY supported only for differential OTA")
-                sys.exit(-2)
-            out_file.seek(op.dst_extents[0].start_block * self.block_size)
-            for ext in op.src_extents:
-                old_file.seek(ext.start_block * self.block_size)
-                data = old_file.read(ext.num_blocks * self.block_size)
-                out_file.write(data)
-        elif op.type == op.SOURCE_BSDIFF:
-            if not self.diff:
-                print("SOURCE_BSDIFF supported only for differential OTA")
-                sys.exit(-3)
-            out_file.seek(op.dst_extents[0].start_block * self.block_size)
-            tmp_buff = io.BytesIO()
-            for ext in op.src_extents:
-                old_file.seek(ext.start_block * self.block_size)
-                old_data = old_file.read(ext.num_blocks * self.block_size)
-                tmp_buff.write(old_data)
-            tmp_buff.seek(0)
-            old_data = tmp_buff.read()
-            tmp_buff.seek(0)
-            tmp_buff.write(bsdiff4.patch(old_data, data))
-            n = 0
-            tmp_buff.seek(0)
-            for ext in op.dst_extents:
-                tmp_buff.seek(n * self.block_size)
-                n += ext.num_blocks
-                data = tmp_buff.read(ext.num_blocks * self.block_size)
-                out_file.seek(ext.start_block * self.block_size)
-                out_file.write(data)
-        elif op.type == op.ZERO:
-            for ext in op.dst_extents:
-                out_file.seek(ext.start_block * self.block_size)
-                out_file.write(b"\x00" * ext.num_blocks * self.block_size)
-        else:
-            print("Unsupported type = %d" % op.type)
-            sys.exit(-1)
-
-        return data
-
-    def dump_part(self, part, update_callback):
-        name = part["partition"].partition_name
-        out_file = open("%s/%s.img" % (self.out, name), "wb")
-        h = hashlib.sha256()
+    def stored_member_offset(self, info):
+        # Absolute offset of a stored zip member's data. ZipExtFile has parsed
+        # the local file header already and remembers where the data starts.
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+            return None
+        return getattr(self.payloadfile, "_orig_compress_start", None)
+
+    def read_payload(self, offset, length, refetch=False):
+        with self.tracer.span("read", "io", offset=offset, bytes_in=length):
+            return self._read_payload(offset, length, refetch)
+
+    def _read_payload(self, offset, length, refetch=False):
+        if self.payload_base is None:
+            # Compressed zip member, only readable through ZipExtFile
+            with self.read_lock:
+                self.payloadfile.seek(offset)
+                return self.payloadfile.read(length)
+        offset += self.payload_base
+        if self.source_fd is not None:
+            return pread(self.source_fd, offset, length)
+        if isinstance(self.source, http_file.HttpFile):
+            # Positional, so remote reads run in parallel; a refetch bypasses
+            # (and replaces) what the block cache holds for the range
+            return self.source.read_at(offset, length, refresh=refetch)
+        if hasattr(self.source, "read_at"):
+            return self.source.read_at(offset, length)
+        # The source file has a single shared position
+        with self.read_lock:
+            self.source.seek(offset)
+            return self.source.read(length)
+
+    def read_op_data(self, op):
+        if op.data_length == 0:
+            return b""
+        offset = self.data_offset + op.data_offset
+        span = self.op_spans.get(id(op))
+        if span is not None:
+            return span.read(self.read_payload, offset, op.data_length)
+        return self.read_payload(offset, op.data_length)
+
+    def discard_op_data(self, op):
+        span = self.op_spans.get(id(op))
+        if span is not None:
+            span.discard()
+
+    def open_part(self, part):
+        partition = part["partition"]
+        name = partition.partition_name
+        path = "%s/%s.img" % (self.out, name)
+
+        done = self.journal.completed(name)
+        if done and not os.path.exists(path):
+            # Nothing to resume from
+            self.journal.reset(name)
+            done = set()
+        out_file = self.writer(path, "r+b" if done else "wb")
 
         if self.diff:
-            old_file = open("%s/%s.img" % (self.old, name), "rb")
+            try:
+                old_file = ImageFile("%s/%s.img" % (self.old, name), "rb")
+            except Exception:
+                out_file.close()
+                raise
         else:
             old_file = None
 
-        for op in part["operations"]:
-            data = self.data_for_op(op, out_file, old_file)
-            update_callback(part["partition"].partition_name, 1)
+        # Size the image up front so ZERO extents can stay sparse, and reserve
+        # the blocks that will receive data to limit fragmentation
+        out_file.truncate(self.partition_size(partition))
+        for offset, length in self.data_ranges(partition):
+            out_file.preallocate(offset, length)
+
+        # Hash the image as it is written, checked when the partition is closed
+        info = partition.new_partition_info
+        if self.verify != "off" and info.hash:
+            if partition.hash_tree_extent.num_blocks or partition.fec_extent.num_blocks:
+                # The hash tree and FEC data are computed on the device, never
+                # written by the payload, so the image cannot match info.hash
+                print(f"{name} - has verity data, skipping the partition hash check")
+            else:
+                out_file.hasher = StreamHasher(
+                    out_file, info.size, info.hash, self.reorder_budget
+                )
+
+        part["out_file"] = out_file
+        part["old_file"] = old_file
+        # Materialize the operations once: the id() keys used for the index (and
+        # the coalesced spans) are only stable while the same objects are alive
+        operations = list(partition.operations)
+        part["index"] = {id(op): i for i, op in enumerate(operations)}
+        part["operations"] = [op for i, op in enumerate(operations) if i not in done]
+        part["remaining"] = len(part["operations"])
+        part["failed"] = False
+
+    def partition_size(self, partition):
+        size = partition.new_partition_info.size
+        for op in partition.operations:
+            for ext in op.dst_extents:
+                size = max(size, (ext.start_block + ext.num_blocks) * self.block_size)
+        return size
+
+    def data_ranges(self, partition):
+        # dst_extents of every operation that writes data, merged into contiguous
+        # ranges; SOURCE_COPY is left out as it may share the source's blocks
+        extents = sorted(
+            (ext.start_block, ext.start_block + ext.num_blocks)
+            for op in partition.operations
+            if op.type not in (op.ZERO, op.SOURCE_COPY)
+            for ext in op.dst_extents
+        )
+        ranges = []
+        for start, end in extents:
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+        return [
+            (start * self.block_size, (end - start) * self.block_size)
+            for start, end in ranges
+        ]
+
+    def close_part(self, part):
+        out_file = part["out_file"]
+        try:
+            if out_file.hasher is not None and not part["failed"]:
+                ok = out_file.hasher.finish()
+                part["hash_read_back"] = out_file.hasher.read_back
+                if not ok:
+                    part["failed"] = True
+                    name = part["partition"].partition_name
+                    print(f"{name} - partition hash mismatch")
+                    # Every operation is journaled by now: have --resume redo
+                    # the whole partition rather than skip it
+                    self.journal.reset(name)
+        finally:
+            if out_file.hasher is not None:
+                out_file.hasher.release()
+            out_file.close()
+            if part["old_file"] is not None:
+                part["old_file"].close()
+        return not part["failed"]
+
+    def check_op_data(self, op, data):
+        if self.hash_pool is None or not op.data_sha256_hash:
+            return None
+        # hashlib releases the GIL, so this overlaps with decoding the same data
+        def check():
+            with self.tracer.span("verify", "op", bytes_in=len(data)):
+                return hashlib.sha256(data).digest() == op.data_sha256_hash
+
+        return self.hash_pool.submit(check)
+
+    def dump_op(self, part, op, submitted=None):
+        if "started" not in part:
+            part["started"] = time.monotonic()
+        if submitted is not None and self.tracer.enabled:
+            # Time spent waiting for a free worker
+            self.tracer.add("queued", "wait", submitted, time.monotonic_ns(), {})
+        name = part["partition"].partition_name
+        with self.tracer.span(
+            "op",
+            "op",
+            partition=name,
+            index=part["index"][id(op)],
+            type=um.InstallOperation.Type.Name(op.type),
+            bytes_in=op.data_length,
+            bytes_out=sum(ext.num_blocks for ext in op.dst_extents) * self.block_size,
+        ):
+            self._dump_op(part, op)
+
+    def _dump_op(self, part, op):
+        if part["failed"]:
+            # Another operation of this partition already failed
+            self.discard_op_data(op)
+            return
+        data = self.read_op_data(op)
+        check = self.check_op_data(op, data)
+        try:
+            self.data_for_op(
+                {"operation": op, "data": data}, part["out_file"], part["old_file"]
+            )
+        except Exception:
+            # Corrupt data may well fail to decode; report it as such
+            if check is None or check.result():
+                raise
+        if check is None or check.result():
+            return
+
+        if self.verify != "refetch":
+            raise ValueError("operation data hash mismatch")
+        # Operations are idempotent, so redo this one from freshly read data
+        data = self.read_payload(
+            self.data_offset + op.data_offset, op.data_length, refetch=True
+        )
+        if hashlib.sha256(data).digest() != op.data_sha256_hash:
+            raise ValueError("operation data hash mismatch after refetch")
+        self.data_for_op(
+            {"operation": op, "data": data}, part["out_file"], part["old_file"]
+        )
 
     def list_partitions_info(self):
         partitions_info = []
         for partition in self.dam.partitions:
             size_in_blocks = sum(ext.num_blocks for op in partition.operations for ext in op.dst_extents)
             size_in_bytes = size_in_blocks * self.block_size
-            if size_in_bytes >= 1024**3:
-                size_str = f"{size_in_bytes / 1024**3:.1f}GB"
-            elif size_in_bytes >= 1024**2:
-                size_str = f"{size_in_bytes / 1024**2:.1f}MB"
-            else:
-                size_str = f"{size_in_bytes / 1024:.1f}KB"
-            
+            size_str = readable_size(size_in_bytes)
+
             partitions_info.append({
                 "partition_name": partition.partition_name,
                 "size_in_blocks": size_in_blocks,
@@ -286,6 +711,163 @@ class Dumper:
         print(readable_info)
         print(f"\nPartition information saved to {output_file}")
 
+    def plan_partitions(self):
+        # Estimate the cost of extracting the selected partitions from the
+        # manifest alone, without reading any operation data
+        # Without coalescing (a negative gap, or a local source) every
+        # operation with data is read on its own
+        gap = self.coalesce_gap if self.coalesce else -1
+        chunk_size = None
+        if isinstance(self.source, http_file.HttpFile) and self.source.connections > 1:
+            chunk_size = self.source.chunk_size
+
+        def requests(spans):
+            if chunk_size is None:
+                return len(spans)
+            return sum(-(-len(span) // chunk_size) for span in spans)
+
+        plan = []
+        all_items = []
+        for partition in self.selected_partitions():
+            items = [(partition, op) for op in partition.operations]
+            all_items.extend(items)
+            spans = plan_ranges(items, self.data_offset, max_gap=gap)
+            op_types = {}
+            for op in partition.operations:
+                type_name = um.InstallOperation.Type.Name(op.type)
+                op_types[type_name] = op_types.get(type_name, 0) + 1
+            plan.append(
+                {
+                    "partition_name": partition.partition_name,
+                    "operations": len(partition.operations),
+                    "op_types": op_types,
+                    "data_bytes": sum(op.data_length for op in partition.operations),
+                    "fetch_bytes": sum(len(span) for span in spans),
+                    "ranges": len(spans),
+                    "requests": requests(spans),
+                    "size_in_bytes": self.partition_size(partition),
+                    # ZERO extents stay sparse
+                    "disk_bytes": self.block_size
+                    * sum(
+                        ext.num_blocks
+                        for op in partition.operations
+                        if op.type != op.ZERO
+                        for ext in op.dst_extents
+                    ),
+                }
+            )
+
+        spans = plan_ranges(all_items, self.data_offset, max_gap=gap)
+        total = {
+            key: sum(info[key] for info in plan)
+            for key in ("operations", "data_bytes", "size_in_bytes", "disk_bytes")
+        }
+        # Spans may merge across partition boundaries
+        total["fetch_bytes"] = sum(len(span) for span in spans)
+        total["ranges"] = len(spans)
+        total["requests"] = requests(spans)
+
+        output_file = os.path.join(self.out, "plan.json")
+        with open(output_file, "w") as f:
+            json.dump(
+                {
+                    "manifest_hash": self.manifest_hash,
+                    "block_size": self.block_size,
+                    "coalesce_gap": gap,
+                    "chunk_size": chunk_size,
+                    "partitions": plan,
+                    "total": total,
+                },
+                f,
+                indent=4,
+            )
+
+        for info in plan:
+            types = ", ".join(f"{k}:{v}" for k, v in sorted(info["op_types"].items()))
+            print(
+                f"{info['partition_name']}: fetch {readable_size(info['fetch_bytes'])}"
+                f" in {info['requests']} requests, output"
+                f" {readable_size(info['size_in_bytes'])}"
+                f" ({readable_size(info['disk_bytes'])} on disk), {types}"
+            )
+        print(
+            f"\ntotal: fetch {readable_size(total['fetch_bytes'])} in"
+            f" {total['requests']} requests, output"
+            f" {readable_size(total['size_in_bytes'])}"
+            f" ({readable_size(total['disk_bytes'])} on disk)"
+        )
+        print(f"\nPlan saved to {output_file}")
+
+    def write_report(self, parts, wall_time):
+        partitions = []
+        for part in parts:
+            partition = part["partition"]
+            # Only what ran now: operations done before a --resume are left out,
+            # as are all of a partition that could not be opened
+            operations = part["operations"] if "index" in part else []
+            op_types = {}
+            for op in operations:
+                type_name = um.InstallOperation.Type.Name(op.type)
+                op_types[type_name] = op_types.get(type_name, 0) + 1
+            finished = part.get("finished")
+            seconds = None
+            if finished is not None:
+                seconds = finished - part.get("started", finished)
+            if part.get("failed", True):
+                status = "failed"
+            else:
+                status = "incomplete" if finished is None else "ok"
+            decompressed = self.block_size * sum(
+                ext.num_blocks for op in operations for ext in op.dst_extents
+            )
+            partitions.append(
+                {
+                    "partition_name": partition.partition_name,
+                    "status": status,
+                    "wall_time": seconds,
+                    "operations": len(operations),
+                    "resumed_operations": len(partition.operations) - len(operations),
+                    "op_types": op_types,
+                    "compressed_bytes": sum(op.data_length for op in operations),
+                    "decompressed_bytes": decompressed,
+                    "mb_per_s": decompressed / seconds / 1024**2 if seconds else None,
+                    "hash_read_back_bytes": part.get("hash_read_back"),
+                }
+            )
+
+        decompressed = sum(info["decompressed_bytes"] for info in partitions)
+        report = {
+            "manifest_hash": self.manifest_hash,
+            "manifest_cached": self.manifest_cached,
+            "mode": self.mode,
+            "workers": self.workers,
+            "status": "failed" if self.failed else "ok",
+            "wall_time": wall_time,
+            "operations": sum(info["operations"] for info in partitions),
+            "compressed_bytes": sum(info["compressed_bytes"] for info in partitions),
+            "decompressed_bytes": decompressed,
+            "mb_per_s": decompressed / wall_time / 1024**2 if wall_time else None,
+            "partitions": partitions,
+            "http": None,
+            "peak_rss": None,
+            "peak_rss_workers": None,
+        }
+        if hasattr(self.source, "stats"):
+            # HttpFile or AsyncHttpFile
+            report["http"] = self.source.stats()
+        if resource is not None:
+            # ru_maxrss is in bytes on macOS, KiB elsewhere
+            scale = 1 if sys.platform == "darwin" else 1024
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            report["peak_rss"] = usage.ru_maxrss * scale
+            if self.mode == "processes":
+                usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+                report["peak_rss_workers"] = usage.ru_maxrss * scale
+
+        with open(self.report, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"\nReport saved to {self.report}")
+
     def extract_and_display_metadata(self):
         # Try to extract and display the metadata file from the zip
         metadata_path = "META-INF/com/android/metadata"
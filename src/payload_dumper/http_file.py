@@ -1,8 +1,20 @@
 import io
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import httpx
 
+from .block_cache import BlockCache
+
+DEFAULT_CONNECTIONS = 4
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+# Times a request cut off by a network error is resumed before giving up
+MAX_RETRIES = 3
+
+# Counters kept by HttpFile, see stats()
+STATS = ("total_bytes", "requests", "retries", "cache_hits", "cache_misses")
+
 
 class HttpFile(io.RawIOBase):
 
@@ -15,29 +27,153 @@ class HttpFile(io.RawIOBase):
     def writable(self) -> bool:
         return False
 
-    def _read_internal(self, buf: bytes) -> int:
-        size = len(buf)
-        end_pos = min(self.pos + size - 1, self.size - 1)
-        size = end_pos - self.pos + 1
-        headers = {"Range": f"bytes={self.pos}-{end_pos}"}
+    def _add_progress_total(self, n: int) -> None:
+        # Progress adds up all reads in flight, as several threads may read at
+        # once through read_at; it starts over once they are all done
+        if self.progress_reporter is None or n == 0:
+            return
+        with self.lock:
+            self.progress_total += n
+            self.progress_reporter(self.progress, self.progress_total)
+
+    def _report_progress(self, n: int) -> None:
+        if self.progress_reporter is None:
+            return
+        with self.lock:
+            self.progress += n
+            self.progress_reporter(self.progress, self.progress_total)
+            if self.progress >= self.progress_total:
+                self.progress = self.progress_total = 0
+
+    def _fetch(self, start: int, buf) -> int:
+        end_pos = start + len(buf) - 1
         n = 0
-        with self.client.stream("GET", self.url, headers=headers) as r:
-            if r.status_code != 206:
-                raise io.UnsupportedOperation("Remote did not return partial content!")
-            if self.progress_reporter is not None:
-                self.progress_reporter(0, size)
-            for chunk in r.iter_bytes(8192):
-                buf[n : n + len(chunk)] = chunk
-                n += len(chunk)
-                if self.progress_reporter is not None:
-                    self.progress_reporter(n, size)
-            if self.progress_reporter is not None:
-                self.progress_reporter(size, size)
+        retries = 0
+        while True:
+            headers = {"Range": f"bytes={start + n}-{end_pos}"}
+            with self.lock:
+                self.requests += 1
+            try:
+                # Every thread reading through read_at shares the connection pool:
+                # wait here for a free connection rather than time out in the pool
+                with self.semaphore, self.client.stream(
+                    "GET", self.url, headers=headers
+                ) as r:
+                    if r.status_code != 206:
+                        raise io.UnsupportedOperation(
+                            "Remote did not return partial content!"
+                        )
+                    for chunk in r.iter_bytes(8192):
+                        buf[n : n + len(chunk)] = chunk
+                        n += len(chunk)
+                        self._report_progress(len(chunk))
+                break
+            except httpx.TransportError:
+                # e.g. the connection was reset: request what is still missing
+                retries += 1
+                if retries > MAX_RETRIES:
+                    raise
+                with self.lock:
+                    self.retries += 1
+        assert n == len(buf)
+        return n
+
+    def _fetch_into(self, start: int, view) -> int:
+        size = len(view)
+        if self.connections <= 1 or size <= self.chunk_size:
+            return self._fetch(start, view)
+        # Split large reads into sub-ranges fetched over parallel connections,
+        # each filling its own slice of the buffer
+        futures = [
+            self.executor.submit(
+                self._fetch, start + off, view[off : off + self.chunk_size]
+            )
+            for off in range(0, size, self.chunk_size)
+        ]
+        wait(futures)
+        return sum(f.result() for f in futures)
+
+    def _read_cached(self, start: int, view, refresh: bool = False) -> int:
+        size = len(view)
+        bs = self.cache.block_size
+        first = start // bs
+        last = (start + size - 1) // bs
+        blocks = {}
+        missing = []
+        for i in range(first, last + 1):
+            data = None
+            if not refresh:
+                data = self.cache.get(self.cache_key, i, min(bs, self.size - i * bs))
+            if data is None:
+                missing.append(i)
+            else:
+                blocks[i] = data
+        with self.lock:
+            self.cache_hits += len(blocks)
+            self.cache_misses += len(missing)
+
+        # Fetch runs of consecutive missing blocks with one read each
+        runs = []
+        for i in missing:
+            if runs and runs[-1][-1] == i - 1:
+                runs[-1].append(i)
+            else:
+                runs.append([i])
+        self._add_progress_total(
+            sum(min((run[-1] + 1) * bs, self.size) - run[0] * bs for run in runs)
+        )
+        n = 0
+        for run in runs:
+            run_start = run[0] * bs
+            buf = bytearray(min((run[-1] + 1) * bs, self.size) - run_start)
+            n += self._fetch_into(run_start, memoryview(buf))
+            for i in run:
+                data = bytes(buf[(i - run[0]) * bs : (i - run[0] + 1) * bs])
+                self.cache.put(self.cache_key, i, data)
+                blocks[i] = data
+        with self.lock:
             self.total_bytes += n
-            self.pos += n
+
+        n = 0
+        for i in range(first, last + 1):
+            lo = max(start - i * bs, 0)
+            chunk = blocks.pop(i)[lo : lo + size - n]
+            view[n : n + len(chunk)] = chunk
+            n += len(chunk)
+        return n
+
+    def _read_range(self, start: int, buf, refresh: bool = False) -> int:
+        size = len(buf)
+        end_pos = min(start + size - 1, self.size - 1)
+        size = end_pos - start + 1
+        if size <= 0:
+            return 0
+        view = memoryview(buf).cast("B")[:size]
+        if self.cache is not None:
+            n = self._read_cached(start, view, refresh)
+        else:
+            self._add_progress_total(size)
+            n = self._fetch_into(start, view)
+            with self.lock:
+                self.total_bytes += n
         assert n == size
         return n
 
+    def _read_internal(self, buf: bytes) -> int:
+        n = self._read_range(self.pos, buf)
+        self.pos += n
+        return n
+
+    def read_at(self, offset: int, size: int, refresh: bool = False) -> bytes:
+        """Read without using or moving the file position, so several threads
+        can read at once (zipfile uses this for concurrent member reads).
+
+        With refresh, the range is fetched from the remote even if cached, and
+        replaces the cached blocks (e.g. after reading corrupt data)."""
+        buf = bytearray(max(min(size, self.size - offset), 0))
+        self._read_range(offset, buf, refresh)
+        return bytes(buf)
+
     def readall(self) -> bytes:
         sz = self.size - self.pos
         buf = bytearray(sz)
@@ -67,22 +203,65 @@ class HttpFile(io.RawIOBase):
     def tell(self) -> int:
         return self.pos
 
-    def __init__(self, url: str, progress_reporter=None):
-        client = httpx.Client()
+    def __init__(
+        self,
+        url: str,
+        progress_reporter=None,
+        connections: int = DEFAULT_CONNECTIONS,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        cache: BlockCache = None,
+    ):
+        client = httpx.Client(limits=httpx.Limits(max_connections=max(connections, 1)))
+        self.semaphore = threading.BoundedSemaphore(max(connections, 1))
         self.url = url
         self.client = client
         h = client.head(url)
         if h.headers.get("Accept-Ranges", "none") != "bytes":
+            client.close()
             raise ValueError("remote does not support ranges!")
         size = int(h.headers.get("Content-Length", 0))
         if size == 0:
+            client.close()
             raise ValueError("remote has no length!")
         self.size = size
         self.pos = 0
         self.total_bytes = 0
+        self.requests = 0
+        self.retries = 0
         self.progress_reporter = progress_reporter
+        self.progress = 0
+        self.progress_total = 0
+        self.lock = threading.Lock()
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.executor = None
+        if connections > 1:
+            # Its threads are only started as large reads need them
+            self.executor = ThreadPoolExecutor(max_workers=connections)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Identifies this version of the remote file, "" if the server gives none
+        self.etag = h.headers.get("ETag") or h.headers.get("Last-Modified", "")
+        # Without one, a republished file of the same length would be served
+        # from stale blocks: don't cache it
+        self.cache = cache if self.etag else None
+        if self.cache is not None:
+            self.cache_key = cache.key(url, self.etag, size)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {name: getattr(self, name) for name in STATS}
+
+    def add_stats(self, stats: dict) -> None:
+        # Counted by another HttpFile for the same URL, e.g. in a worker process
+        with self.lock:
+            for name in STATS:
+                setattr(self, name, getattr(self, name) + stats[name])
 
     def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
         self.client.close()
 
     def closed(self) -> bool:
@@ -123,6 +302,6 @@ if __name__ == "__main__":
             with z.open(name) as payload:
                 print(name, "compress type:", payload._compress_type, 'size:', payload._left)
         with z.open("comet_beta-bp21.241121.009/image-comet_beta-bp21.241121.009.zip") as f2:
-            z2 = zipfile.ZipFile(f2)
+            z2 = zipfile.ZipFile(f2, seek_index_interval=16 * 1024 * 1024)
             print(z2.namelist())
         print("total read:", f.total_bytes)
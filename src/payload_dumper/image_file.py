@@ -0,0 +1,230 @@
+import ctypes
+import mmap
+import os
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+# _IOW(0x94, 13, struct file_clone_range)
+FICLONERANGE = 0x4020940D
+
+ZERO_CHUNK_SIZE = 1024 * 1024
+COPY_CHUNK_SIZE = 16 * 1024 * 1024
+
+MODES = {
+    "rb": os.O_RDONLY,
+    "r+b": os.O_RDWR,
+    "wb": os.O_RDWR | os.O_CREAT | os.O_TRUNC,
+}
+
+try:
+    # libc is already loaded; ctypes.util.find_library would spawn a subprocess
+    _libc = ctypes.CDLL(None, use_errno=True)
+    if hasattr(_libc, "fallocate64"):
+        _fallocate = _libc.fallocate64
+    elif ctypes.sizeof(ctypes.c_long) == 8:
+        # LP64: off_t, and so fallocate's offsets, are 64 bits wide
+        _fallocate = _libc.fallocate
+    else:
+        # fallocate would take 32-bit offsets: leave it alone
+        _fallocate = None
+    if _fallocate is not None:
+        _fallocate.argtypes = [ctypes.c_int] * 2 + [ctypes.c_int64] * 2
+        _fallocate.restype = ctypes.c_int
+except (AttributeError, OSError, TypeError):
+    # Not glibc/musl (macOS, Windows): no hole punching
+    _fallocate = None
+
+
+def punch_hole(fd: int, offset: int, length: int) -> bool:
+    if _fallocate is None:
+        return False
+    mode = FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE
+    return _fallocate(fd, mode, offset, length) == 0
+
+
+def pread(fd: int, offset: int, size: int) -> bytes:
+    chunks = []
+    while size > 0:
+        chunk = os.pread(fd, size, offset)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        offset += len(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+class ImageFile:
+    """Partition image shared by the workers dumping its operations.
+
+    Reads and writes are positional (pread/pwrite), so any number of threads
+    can use one image without sharing a file position. Platforms without
+    pread/pwrite fall back to seek and read/write under a lock.
+    """
+
+    def __init__(self, path: str, mode: str = "rb"):
+        self.path = path
+        self.fd = os.open(path, MODES[mode] | getattr(os, "O_BINARY", 0), 0o666)
+        self.lock = threading.Lock()
+        # A file we created empty reads back zeros wherever nothing is written
+        self.fresh = "w" in mode
+        # Optional StreamHasher fed with everything written to the image
+        self.hasher = None
+        # Cleared once the filesystem turns out not to support them
+        self.reflink = fcntl is not None
+        self.copy_file_range = hasattr(os, "copy_file_range")
+
+    def truncate(self, size: int) -> None:
+        os.ftruncate(self.fd, size)
+
+    def preallocate(self, offset: int, length: int) -> None:
+        # fallocate(2) rather than posix_fallocate: where the filesystem can't
+        # reserve blocks, glibc's posix_fallocate falls back to writing them all
+        if _fallocate is not None:
+            # On failure blocks just get allocated on write
+            _fallocate(self.fd, 0, offset, length)
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        if not hasattr(os, "pread"):
+            with self.lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                return os.read(self.fd, size)
+        return pread(self.fd, offset, size)
+
+    def write_at(self, offset: int, data) -> None:
+        data = memoryview(data).cast("B")
+        self._write(offset, data)
+        if self.hasher is not None:
+            self.hasher.update(offset, data)
+
+    def zero(self, offset: int, length: int) -> None:
+        """Make a range read back as zeros, leaving a hole where possible."""
+        self._zero(offset, length)
+        if self.hasher is not None:
+            self.hasher.zero(offset, length)
+
+    def copy_range(self, src, src_offset: int, offset: int, length: int) -> None:
+        """Copy a range of another image into this one without going through
+        Python memory where possible: a reflink on filesystems that share
+        extents (btrfs, xfs), else copy_file_range, else read and write."""
+        done = 0
+        if self.reflink and self._aligned(src_offset, offset, length):
+            try:
+                arg = struct.pack("=qQQQ", src.fd, src_offset, length, offset)
+                fcntl.ioctl(self.fd, FICLONERANGE, arg)
+                done = length
+            except OSError:
+                self.reflink = False
+
+        while done < length and self.copy_file_range:
+            try:
+                n = os.copy_file_range(
+                    src.fd, self.fd, length - done, src_offset + done, offset + done
+                )
+            except OSError:
+                self.copy_file_range = False
+                break
+            if n == 0:
+                break
+            done += n
+
+        while done < length:
+            size = min(length - done, COPY_CHUNK_SIZE)
+            data = src.read_at(src_offset + done, size)
+            if not data:
+                break
+            self._write(offset + done, memoryview(data))
+            done += len(data)
+
+        if self.hasher is not None:
+            self.hasher.written(offset, length)
+
+    def _aligned(self, *values) -> bool:
+        block_size = os.fstat(self.fd).st_blksize
+        return all(value % block_size == 0 for value in values)
+
+    def _write(self, offset: int, data) -> None:
+        if not hasattr(os, "pwrite"):
+            with self.lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                while data:
+                    data = data[os.write(self.fd, data) :]
+            return
+
+        while data:
+            n = os.pwrite(self.fd, data, offset)
+            data = data[n:]
+            offset += n
+
+    def _zero(self, offset: int, length: int) -> None:
+        if self.fresh or punch_hole(self.fd, offset, length):
+            return
+        chunk = memoryview(bytes(min(length, ZERO_CHUNK_SIZE)))
+        while length > 0:
+            n = min(length, len(chunk))
+            self._write(offset, chunk[:n])
+            offset += n
+            length -= n
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MmapImageFile(ImageFile):
+    """ImageFile whose writes are copied straight into a shared mapping.
+
+    The image is mapped once it has been sized with truncate(); writeback of
+    the dirty pages is left to the kernel. Holes may be punched under the live
+    mapping, the pages just drop out of it.
+    """
+
+    def __init__(self, path: str, mode: str = "r+b"):
+        super().__init__(path, mode)
+        self.map = None
+        # An existing image (resumed, or opened by a worker process) is mapped
+        # right away at its current size
+        size = os.fstat(self.fd).st_size
+        if size > 0 and mode != "rb":
+            self.map = mmap.mmap(self.fd, size)
+
+    def truncate(self, size: int) -> None:
+        super().truncate(size)
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if size > 0:
+            self.map = mmap.mmap(self.fd, size)
+
+    def _write(self, offset: int, data) -> None:
+        if self.map is None or offset + len(data) > len(self.map):
+            return super()._write(offset, data)
+        self.map[offset : offset + len(data)] = data
+
+    def close(self) -> None:
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        super().close()
+
+
+WRITERS = {
+    "pwrite": ImageFile,
+    "mmap": MmapImageFile,
+}
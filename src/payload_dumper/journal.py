@@ -0,0 +1,76 @@
+import os
+import threading
+
+JOURNAL_NAME = ".payload_dumper.journal"
+
+
+class Journal:
+    """Append-only record of the operations already written to the output.
+
+    The first line holds the hash of the manifest the entries belong to, each
+    following line is "<partition> <operation index>". A journal written for
+    another payload is ignored.
+    """
+
+    def __init__(self, directory: str, manifest_hash: str):
+        self.path = os.path.join(directory, JOURNAL_NAME)
+        self.manifest_hash = manifest_hash
+        self.done = {}
+        self.file = None
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        if not lines or lines[0] != f"manifest {self.manifest_hash}":
+            return
+        for line in lines[1:]:
+            name, sep, index = line.rpartition(" ")
+            # A torn last line after a crash is simply dropped
+            if sep and index.isdigit():
+                self.done.setdefault(name, set()).add(int(index))
+
+    def completed(self, name: str) -> set:
+        return self.done.get(name, set())
+
+    def reset(self, name: str) -> None:
+        with self.lock:
+            self.done.pop(name, None)
+            if self.file is not None:
+                # Already appending: rewrite it without the partition
+                self.file.close()
+                self._rewrite()
+
+    def start(self) -> None:
+        with self.lock:
+            self._rewrite()
+
+    def _rewrite(self) -> None:
+        # Rewrite the journal with only the entries still valid, then append
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(f"manifest {self.manifest_hash}\n")
+            for name, indices in self.done.items():
+                f.writelines(f"{name} {index}\n" for index in sorted(indices))
+        os.replace(tmp, self.path)
+        self.file = open(self.path, "a")
+
+    def record(self, name: str, index: int) -> None:
+        with self.lock:
+            self.done.setdefault(name, set()).add(index)
+            self.file.write(f"{name} {index}\n")
+            self.file.flush()
+
+    def close(self, remove: bool = False) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import tempfile
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def default_directory() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "payload_dumper", "manifests")
+
+
+class ManifestCache:
+    """On-disk cache of parsed payload headers.
+
+    An entry holds the raw manifest, the metadata signature and where the
+    payload and its operation data start in the source file, so a repeated
+    run skips the header and zip directory reads. Entries are keyed by the
+    identity of the source: path, size and mtime for local files, URL, ETag
+    and length for remote ones. Remote files without an ETag or Last-Modified
+    header can't be told apart from a changed file and are never cached.
+
+    As in BlockCache, an entry's mtime is its LRU timestamp: hits touch it,
+    and the least recently used entries are removed once the cache grows past
+    max_size.
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def key(self, source):
+        # HttpFile or AsyncHttpFile
+        if getattr(source, "url", None) is not None:
+            if not source.etag:
+                return None
+            ident = f"url\n{source.url}\n{source.etag}\n{source.size}"
+        else:
+            try:
+                st = os.fstat(source.fileno())
+                path = os.path.abspath(source.name)
+            except (AttributeError, OSError, TypeError):
+                return None
+            ident = f"file\n{path}\n{st.st_size}\n{st.st_mtime_ns}"
+        return hashlib.sha256(ident.encode()).hexdigest()
+
+    def get(self, source):
+        """Return (manifest, metadata_signature, payload_base, data_offset), or
+        None if the source has no entry. data_offset is absolute."""
+        key = self.key(source)
+        if key is None:
+            return None
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                signature = f.read(header["signature_size"])
+                manifest = f.read(header["manifest_size"])
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        if (
+            len(signature) != header["signature_size"]
+            or len(manifest) != header["manifest_size"]
+        ):
+            return None
+        return manifest, signature, header["payload_base"], header["data_offset"]
+
+    def put(self, source, manifest, signature, payload_base, data_offset) -> None:
+        key = self.key(source)
+        if key is None:
+            return
+        header = {
+            "manifest_size": len(manifest),
+            "signature_size": len(signature),
+            "payload_base": payload_base,
+            "data_offset": data_offset,
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".")
+        except OSError:
+            # Caching is best effort, e.g. for a read-only home directory
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(json.dumps(header).encode() + b"\n")
+                f.write(signature)
+                f.write(manifest)
+            os.replace(tmp, os.path.join(self.directory, key))
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        total = 0
+        try:
+            scan = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in scan:
+            if entry.name.startswith("."):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                # Evicted by another process meanwhile
+                pass
+            total -= size
+            if total <= self.max_size:
+                break
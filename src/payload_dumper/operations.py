@@ -0,0 +1,110 @@
+import bz2
+import lzma
+import sys
+
+import bsdiff4
+
+
+class OperationDecoder:
+    """Applies InstallOperations to partition images.
+
+    Expects `block_size`, `diff` and `tracer` attributes; shared by Dumper and
+    the worker processes of process_pool.
+    """
+
+    def data_for_op(self, operation, out_file, old_file):
+        data = operation["data"]
+        op = operation["operation"]
+
+        if op.type in (op.REPLACE_XZ, op.REPLACE_BZ):
+            with self.tracer.span("decode", "op", bytes_in=len(data)) as span:
+                if op.type == op.REPLACE_XZ:
+                    dec = lzma.LZMADecompressor()
+                else:
+                    dec = bz2.BZ2Decompressor()
+                data = dec.decompress(data)
+                span.args["bytes_out"] = len(data)
+            self.write_extents(out_file, op.dst_extents, data)
+        elif op.type == op.REPLACE:
+            self.write_extents(out_file, op.dst_extents, data)
+        elif op.type == op.SOURCE_COPY:
+            if not self.diff:
+                print("SOURCE_COPY supported only for differential OTA")
+                sys.exit(-2)
+            with self.tracer.span("copy", "op") as span:
+                copied = 0
+                for src_offset, dst_offset, length in self.pair_extents(
+                    op.src_extents, op.dst_extents
+                ):
+                    out_file.copy_range(old_file, src_offset, dst_offset, length)
+                    copied += length
+                span.args["bytes_out"] = copied
+        elif op.type == op.SOURCE_BSDIFF:
+            if not self.diff:
+                print("SOURCE_BSDIFF supported only for differential OTA")
+                sys.exit(-3)
+            with self.tracer.span("patch", "op", bytes_in=len(data)) as span:
+                src = self.read_extents(old_file, op.src_extents)
+                patched = bsdiff4.patch(src, data)
+                span.args["bytes_src"] = len(src)
+                span.args["bytes_out"] = len(patched)
+            self.write_extents(out_file, op.dst_extents, patched)
+        elif op.type == op.ZERO:
+            # The image is pre-sized, so this leaves (or punches) a hole
+            with self.tracer.span("zero", "op"):
+                for ext in op.dst_extents:
+                    out_file.zero(
+                        ext.start_block * self.block_size,
+                        ext.num_blocks * self.block_size,
+                    )
+        else:
+            print("Unsupported type = %d" % op.type)
+            sys.exit(-1)
+
+        return data
+
+    def read_extents(self, image, extents):
+        # bsdiff4 only takes immutable bytes, so the extents are read with pread
+        # and joined once (a single extent is used as read, without a copy)
+        return b"".join(
+            image.read_at(
+                ext.start_block * self.block_size, ext.num_blocks * self.block_size
+            )
+            for ext in extents
+        )
+
+    def write_extents(self, out_file, extents, data):
+        # Scatter data over the extents, each with its own positional write
+        with self.tracer.span("write", "op", bytes_out=len(data)):
+            data = memoryview(data)
+            for ext in extents:
+                if not data:
+                    break
+                size = ext.num_blocks * self.block_size
+                out_file.write_at(ext.start_block * self.block_size, data[:size])
+                data = data[size:]
+
+    def pair_extents(self, src_extents, dst_extents):
+        # Split src/dst extent lists into (src_offset, dst_offset, length) runs
+        dst = iter(dst_extents)
+        dst_start = dst_left = 0
+        for ext in src_extents:
+            src_start = ext.start_block
+            src_left = ext.num_blocks
+            while src_left > 0:
+                if dst_left == 0:
+                    dst_ext = next(dst, None)
+                    if dst_ext is None:
+                        return
+                    dst_start, dst_left = dst_ext.start_block, dst_ext.num_blocks
+                    continue
+                n = min(src_left, dst_left)
+                yield (
+                    src_start * self.block_size,
+                    dst_start * self.block_size,
+                    n * self.block_size,
+                )
+                src_start += n
+                src_left -= n
+                dst_start += n
+                dst_left -= n
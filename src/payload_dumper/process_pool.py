@@ -0,0 +1,145 @@
+import hashlib
+import time
+
+from . import update_metadata_pb2 as um
+from .block_cache import BlockCache
+from .http_file import STATS, HttpFile
+from .image_file import WRITERS, ImageFile
+from .operations import OperationDecoder
+from .tracing import NULL_TRACER, Tracer
+
+# Worker state, set up once per process by init_worker
+_worker = None
+
+
+class Worker(OperationDecoder):
+    """Runs operations in a worker process of a ProcessPoolExecutor.
+
+    The worker opens the payload, old images and output images itself from the
+    paths and offsets in its config, so only small operation descriptors are
+    pickled between processes, never operation data. Everything it opens is
+    kept open (and mapped, with the mmap writer) for the following tasks, until
+    the worker process exits with the pool.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.block_size = config["block_size"]
+        self.diff = config["diff"]
+        self.writer = WRITERS[config["writer"]]
+        self.payload = None
+        # Partition name -> (out_file, old_file)
+        self.images = {}
+        self.tracer = NULL_TRACER
+
+    def open_payload(self):
+        source = self.config["source"]
+        if "url" in source:
+            cache = None
+            if source["cache_dir"] is not None:
+                cache = BlockCache(source["cache_dir"], source["cache_size"])
+            return HttpFile(
+                source["url"],
+                connections=source["connections"],
+                chunk_size=source["chunk_size"],
+                cache=cache,
+            )
+        return ImageFile(source["path"], "rb")
+
+    def read(self, offset, length, refetch=False):
+        if self.payload is None:
+            self.payload = self.open_payload()
+        with self.tracer.span("read", "io", offset=offset, bytes_in=length):
+            offset += self.config["base"]
+            if refetch and isinstance(self.payload, HttpFile):
+                # Bypass (and replace) what the block cache holds for the range
+                return self.payload.read_at(offset, length, refresh=True)
+            return self.payload.read_at(offset, length)
+
+    def http_stats(self):
+        if isinstance(self.payload, HttpFile):
+            return self.payload.stats()
+        return dict.fromkeys(STATS, 0)
+
+    def get_images(self, name):
+        if name not in self.images:
+            self.images[name] = self.open_images(name)
+        return self.images[name]
+
+    def open_images(self, name):
+        out_file = self.writer("%s/%s.img" % (self.config["out"], name), "r+b")
+        # Created empty by the main process: ZERO extents need no hole punching
+        out_file.fresh = name in self.config["fresh"]
+        old_file = None
+        if self.diff:
+            old_file = ImageFile("%s/%s.img" % (self.config["old"], name), "rb")
+        return out_file, old_file
+
+    def read_op_data(self, op, span, span_data):
+        if op.data_length == 0:
+            return b""
+        offset = self.config["data_offset"] + op.data_offset
+        if span_data is not None:
+            start = offset - span[0]
+            return span_data[start : start + op.data_length]
+        return self.read(offset, op.data_length)
+
+    def check_op_data(self, op, data):
+        if self.config["verify"] == "off" or not op.data_sha256_hash:
+            return data
+        if hashlib.sha256(data).digest() == op.data_sha256_hash:
+            return data
+        if self.config["verify"] != "refetch":
+            raise ValueError("operation data hash mismatch")
+        data = self.read(
+            self.config["data_offset"] + op.data_offset, op.data_length, refetch=True
+        )
+        if hashlib.sha256(data).digest() != op.data_sha256_hash:
+            raise ValueError("operation data hash mismatch after refetch")
+        return data
+
+    def run(self, task):
+        started = time.monotonic()
+        http_stats = self.http_stats()
+        if self.config["trace"]:
+            # A fresh tracer per task: its spans are sent back with the result
+            self.tracer = Tracer()
+        span = task["span"]
+        span_data = None
+        if span is not None:
+            span_data = self.read(span[0], span[1])
+        for name, op_bytes in task["ops"]:
+            op = um.InstallOperation()
+            op.ParseFromString(op_bytes)
+            out_file, old_file = self.get_images(name)
+            with self.tracer.span(
+                "op",
+                "op",
+                partition=name,
+                type=um.InstallOperation.Type.Name(op.type),
+                bytes_in=op.data_length,
+            ):
+                data = self.read_op_data(op, span, span_data)
+                with self.tracer.span("verify", "op", bytes_in=len(data)):
+                    data = self.check_op_data(op, data)
+                self.data_for_op({"operation": op, "data": data}, out_file, old_file)
+        trace = None
+        if self.config["trace"]:
+            trace = (self.tracer.events, self.tracer.threads)
+        return {
+            "started": started,
+            "http": {
+                name: value - http_stats[name]
+                for name, value in self.http_stats().items()
+            },
+            "trace": trace,
+        }
+
+
+def init_worker(config):
+    global _worker
+    _worker = Worker(config)
+
+
+def run_task(task):
+    return _worker.run(task)
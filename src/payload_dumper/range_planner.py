@@ -0,0 +1,74 @@
+import threading
+
+DEFAULT_MAX_GAP = 64 * 1024
+DEFAULT_MAX_SPAN_SIZE = 32 * 1024 * 1024
+
+
+class Span:
+    """A contiguous range of the payload covering the data of several operations.
+
+    The span is fetched with a single read the first time one of its
+    operations needs data, and dropped once every operation has taken its
+    slice, so memory is bounded by the spans currently in use.
+    """
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.items = []
+        self.data = None
+        self.remaining = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def read(self, reader, offset: int, length: int) -> bytes:
+        with self.lock:
+            if self.data is None:
+                self.data = reader(self.start, len(self))
+            start = offset - self.start
+            data = self.data[start : start + length]
+            self._release()
+        return data
+
+    def discard(self) -> None:
+        with self.lock:
+            self._release()
+
+    def _release(self) -> None:
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.data = None
+
+
+def plan_ranges(
+    items, data_offset, max_gap=DEFAULT_MAX_GAP, max_size=DEFAULT_MAX_SPAN_SIZE
+):
+    """Coalesce the data ranges of (part, operation) items into spans.
+
+    Ranges are merged when the hole between them is at most max_gap bytes and
+    the merged span stays within max_size (a single larger operation gets a
+    span of its own). Operations without data are skipped.
+    """
+    items = sorted(
+        (item for item in items if item[1].data_length > 0),
+        key=lambda item: item[1].data_offset,
+    )
+    spans = []
+    span = None
+    for item in items:
+        op = item[1]
+        start = data_offset + op.data_offset
+        end = start + op.data_length
+        if (
+            span is None
+            or start - span.end > max_gap
+            or max(end, span.end) - span.start > max_size
+        ):
+            span = Span(start, end)
+            spans.append(span)
+        span.end = max(span.end, end)
+        span.items.append(item)
+        span.remaining += 1
+    return spans
@@ -0,0 +1,64 @@
+from . import update_metadata_pb2 as um
+
+Op = um.InstallOperation
+
+# Rough relative cost of producing one byte of output for each operation type.
+# Only the ordering matters: bz2 and bsdiff are the slowest, ZERO is nearly free.
+OP_WEIGHTS = {
+    Op.REPLACE: 1,
+    Op.REPLACE_XZ: 4,
+    Op.REPLACE_BZ: 8,
+    Op.SOURCE_COPY: 1,
+    Op.SOURCE_BSDIFF: 8,
+    Op.ZERO: 0,
+}
+
+
+def op_cost(op, block_size):
+    dst_bytes = sum(ext.num_blocks for ext in op.dst_extents) * block_size
+    return op.data_length + dst_bytes * OP_WEIGHTS.get(op.type, 1)
+
+
+def first_block(items, part):
+    # Where the operations of part among items start writing
+    blocks = [
+        op.dst_extents[0].start_block
+        for owner, op in items
+        if owner is part and op.dst_extents
+    ]
+    return min(blocks, default=0)
+
+
+def schedule(partitions, block_size, spans=()):
+    """Queue the operations of all partitions, most expensive partition first.
+
+    Returns a list of (part, operation) pairs. Within a partition, operations
+    are queued by their first destination block so its StreamHasher can hash
+    the writes as they land instead of buffering them or reading them back;
+    across partitions, the most expensive one goes first so that it does not
+    become the long tail of a run.
+
+    Operations sharing a coalesced span (see range_planner) are kept together,
+    in the place of the span's first block, so each fetched span is consumed
+    and freed before the workers move on to the next one.
+    """
+    grouped = set()
+    groups = {id(part): [] for part in partitions}
+    for span in spans:
+        # A span crossing a partition boundary goes with its first partition
+        groups[id(span.items[0][0])].append(span.items)
+        grouped.update(id(op) for _, op in span.items)
+    for part in partitions:
+        groups[id(part)].extend(
+            [(part, op)] for op in part["operations"] if id(op) not in grouped
+        )
+
+    queue = []
+    for part in sorted(
+        partitions,
+        key=lambda part: sum(op_cost(op, block_size) for op in part["operations"]),
+        reverse=True,
+    ):
+        ordered = sorted(groups[id(part)], key=lambda items: first_block(items, part))
+        queue.extend(item for items in ordered for item in items)
+    return queue
@@ -0,0 +1,143 @@
+import hashlib
+import threading
+
+DEFAULT_REORDER_BUFFER = 64 * 1024 * 1024
+READ_BACK_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Marks a pending range that was zeroed rather than written
+ZERO = object()
+
+
+class ReorderBudget:
+    """Bytes of out-of-order writes that StreamHashers may buffer, shared by
+    the hashers of all partitions extracted at once."""
+
+    def __init__(self, limit: int = DEFAULT_REORDER_BUFFER):
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def take(self, n: int) -> bool:
+        with self.lock:
+            if self.used + n > self.limit:
+                return False
+            self.used += n
+            return True
+
+    def give(self, n: int) -> None:
+        with self.lock:
+            self.used -= n
+
+
+class StreamHasher:
+    """Hash an image in order while its ranges are written out of order.
+
+    Writes at the current hash position are hashed right away; writes further
+    ahead wait in a reorder buffer bounded by `budget`, which may be shared
+    with other hashers. Ranges that do not fit, and ranges never written in
+    this run, are read back from the image when the hash reaches them, so the
+    image is never read a second time in full unless a range gets rewritten
+    after it was hashed.
+    """
+
+    def __init__(self, image, size: int, expected: bytes, budget: ReorderBudget = None):
+        self.image = image
+        self.size = size
+        self.expected = expected
+        self.budget = ReorderBudget() if budget is None else budget
+        self.hash = hashlib.sha256()
+        self.offset = 0
+        # offset -> (length, data), data being bytes, ZERO or None (read back)
+        self.pending = {}
+        self.buffered = 0
+        # Bytes hashed from the image rather than as they were written
+        self.read_back = 0
+        self.rehash = False
+        self.lock = threading.Lock()
+
+    def update(self, offset: int, data) -> None:
+        self._add(offset, len(data), data)
+
+    def zero(self, offset: int, length: int) -> None:
+        self._add(offset, length, ZERO)
+
+    def written(self, offset: int, length: int) -> None:
+        # Written without passing through us (e.g. copy_file_range); the data
+        # is read back from the image when the hash reaches it
+        self._add(offset, length, None)
+
+    def _add(self, offset: int, length: int, data) -> None:
+        if offset >= self.size:
+            return
+        length = min(length, self.size - offset)
+        with self.lock:
+            if offset < self.offset or offset in self.pending:
+                # Rewritten after being hashed (e.g. a refetched operation)
+                self.rehash = True
+                return
+            if offset == self.offset:
+                self._consume(length, data)
+                self._drain()
+            elif data is None or data is ZERO:
+                self.pending[offset] = (length, data)
+            elif self.budget.take(length):
+                self.pending[offset] = (length, bytes(data[:length]))
+                self.buffered += length
+            else:
+                self.pending[offset] = (length, None)
+
+    def _consume(self, length: int, data) -> None:
+        if data is None:
+            end = self.offset + length
+            offset = self.offset
+            while offset < end:
+                size = min(READ_BACK_CHUNK_SIZE, end - offset)
+                chunk = self.image.read_at(offset, size)
+                if not chunk:
+                    # Short image; let the hash mismatch
+                    break
+                self.hash.update(chunk)
+                self.read_back += len(chunk)
+                offset += len(chunk)
+        elif data is ZERO:
+            zeros = bytes(min(length, READ_BACK_CHUNK_SIZE))
+            left = length
+            while left > 0:
+                self.hash.update(zeros[: min(left, len(zeros))])
+                left -= len(zeros)
+        else:
+            self.hash.update(data[:length])
+        self.offset += length
+
+    def _drain(self) -> None:
+        while self.offset in self.pending:
+            length, data = self.pending.pop(self.offset)
+            if data is not None and data is not ZERO:
+                self.buffered -= length
+                self.budget.give(length)
+            self._consume(length, data)
+
+    def finish(self) -> bool:
+        with self.lock:
+            if self.rehash:
+                self._release()
+                self.hash = hashlib.sha256()
+                self.offset = 0
+            self._drain()
+            while self.offset < self.size:
+                following = [offset for offset in self.pending if offset > self.offset]
+                end = min(following, default=self.size)
+                # Never written here in this run: take it from the image
+                self._consume(end - self.offset, None)
+                self._drain()
+            return self.hash.digest() == self.expected
+
+    def release(self) -> None:
+        """Drop the buffered writes, e.g. when the image is not finished."""
+        with self.lock:
+            self._release()
+
+    def _release(self) -> None:
+        self.budget.give(self.buffered)
+        self.buffered = 0
+        self.pending = {}
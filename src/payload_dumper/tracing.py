@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+
+
+class Span:
+    __slots__ = ("tracer", "name", "cat", "args", "start")
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.monotonic_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add(self.name, self.cat, self.start, time.monotonic_ns(), self.args)
+
+
+class Tracer:
+    """Records timed spans and saves them as a Chrome/Perfetto trace.
+
+    Spans are kept as plain tuples, appended without locking (list.append is
+    atomic), and only turned into trace events when saved. Timestamps come
+    from the monotonic clock, which is shared by all processes on Linux, so
+    events recorded in worker processes line up with the main process.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.events = []
+        self.threads = {}
+
+    def span(self, name: str, cat: str, **args) -> Span:
+        return Span(self, name, cat, args)
+
+    def add(self, name: str, cat: str, start: int, end: int, args: dict) -> None:
+        tid = threading.get_native_id()
+        if tid not in self.threads:
+            self.threads[tid] = threading.current_thread().name
+        self.events.append((self.pid, tid, name, cat, start, end, args))
+
+    def extend(self, events, threads) -> None:
+        # Spans recorded by another Tracer, e.g. in a worker process
+        self.events.extend(events)
+        self.threads.update(threads)
+
+    def save(self, path: str) -> None:
+        pids = {pid for pid, *_ in self.events} | {self.pid}
+        events = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": "main" if pid == self.pid else f"worker {pid}"},
+            }
+            for pid in pids
+        ]
+        tids = {(pid, tid) for pid, tid, *_ in self.events}
+        events += [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": self.threads.get(tid, str(tid))},
+            }
+            for pid, tid in tids
+        ]
+        events += [
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "pid": pid,
+                "tid": tid,
+                "ts": start / 1000,
+                "dur": (end - start) / 1000,
+                "args": args,
+            }
+            for pid, tid, name, cat, start, end, args in self.events
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+class NullSpan:
+    __slots__ = ("args",)
+
+    def __init__(self):
+        self.args = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class NullTracer:
+    """Stands in for Tracer when tracing is off, recording nothing."""
+
+    enabled = False
+    _span = NullSpan()
+
+    def span(self, name, cat, **args):
+        return self._span
+
+    def add(self, name, cat, start, end, args):
+        pass
+
+
+NULL_TRACER = NullTracer()
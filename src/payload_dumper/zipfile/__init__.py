@@ -4,6 +4,7 @@ Read and write ZIP files.
 XXX references to utf-8 need further investigation.
 """
 import binascii
+import bisect
 import importlib.util
 import io
 import os
@@ -815,6 +816,81 @@ class _SharedFile:
             self._file = None
             self._close(fileobj)
 
+class _PositionalSharedFile(_SharedFile):
+    """_SharedFile reading at its own offset through a positional read_at(pos, n),
+    so concurrent readers of different members take no lock and never move
+    the position of the underlying file."""
+
+    def __init__(self, file, pos, close, lock, writing, read_at, size):
+        super().__init__(file, pos, close, lock, writing)
+        self._read_at = read_at
+        self._size = size
+
+    def seek(self, offset, whence=0):
+        if self._writing():
+            raise ValueError("Can't reposition in the ZIP file while "
+                    "there is an open writing handle on it. "
+                    "Close the writing handle before trying to read.")
+        if whence == 0:
+            pos = offset
+        elif whence == 1:
+            pos = self._pos + offset
+        elif whence == 2:
+            pos = self._size() + offset
+        else:
+            raise ValueError("invalid whence (%r)" % (whence,))
+        if pos < 0:
+            raise ValueError("negative seek value %r" % (pos,))
+        self._pos = pos
+        return self._pos
+
+    def read(self, n=-1):
+        if self._writing():
+            raise ValueError("Can't read from the ZIP file while there "
+                    "is an open writing handle on it. "
+                    "Close the writing handle before trying to read.")
+        if n is None or n < 0:
+            n = max(self._size() - self._pos, 0)
+        data = self._read_at(self._pos, n)
+        self._pos += len(data)
+        return data
+
+
+def _pread_all(fd, pos, n):
+    chunks = []
+    while n > 0:
+        chunk = os.pread(fd, n, pos)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        pos += len(chunk)
+        n -= len(chunk)
+    return b"".join(chunks)
+
+
+def _shared_file(fp, pos, close, lock, writing, read_only):
+    # Objects with a positional read (HttpFile) and, for archives opened for
+    # reading only, real files on platforms with pread get a lock-free reader
+    read_at = getattr(fp, "read_at", None)
+    if read_at is not None:
+        size = getattr(fp, "size", None)
+        if isinstance(size, int):
+            return _PositionalSharedFile(fp, pos, close, lock, writing, read_at,
+                                         lambda: size)
+    if read_only and hasattr(os, "pread"):
+        try:
+            fd = fp.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None
+        if isinstance(fd, int) and fd >= 0:
+            # pread bypasses the file object's buffer
+            fp.flush()
+            return _PositionalSharedFile(fp, pos, close, lock, writing,
+                                         lambda pos, n: _pread_all(fd, pos, n),
+                                         lambda: os.fstat(fd).st_size)
+    return _SharedFile(fp, pos, close, lock, writing)
+
+
 # Provide the tell method for unseekable stream
 class _Tellable:
     def __init__(self, fp):
@@ -836,6 +912,53 @@ class _Tellable:
         self.fp.close()
 
 
+class _SeekIndex:
+    """Checkpoints of a deflated member's decompression, for fast seeking.
+
+    Every `interval` bytes of output a copy of the decompressor is kept along
+    with the uncompressed and compressed positions it belongs to, so a seek
+    resumes from the nearest checkpoint instead of decompressing from the
+    start of the member. Checkpoints are recorded as the member is read and
+    shared by every ZipExtFile opened on it from the same ZipFile.
+
+    Unlike zran, the checkpoints can't be saved to disk: resuming from a
+    window and bit offset needs inflatePrime(), which Python's zlib does not
+    expose, so whole decompressor states (about 40 KiB each) are kept instead.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._positions = [0]
+        self._checkpoints = [None]
+        self._lock = threading.Lock()
+
+    def record(self, pos, compress_pos, decompressor):
+        # compress_pos counts the compressed bytes read so far; input read but
+        # not yet decompressed stays in the copied decompressor's unconsumed_tail
+        with self._lock:
+            if pos < self._positions[-1] + self.interval:
+                return
+            self._positions.append(pos)
+            self._checkpoints.append((compress_pos, decompressor.copy()))
+
+    def limit(self, pos, n):
+        """Cap a read of n bytes at pos to end where the next checkpoint is
+        due, so checkpoints are `interval` apart whatever the read sizes."""
+        with self._lock:
+            due = self._positions[-1] + self.interval
+        return min(n, due - pos) if due > pos else n
+
+    def find(self, pos):
+        """Return (pos, compress_pos, decompressor) of the last checkpoint
+        at or before pos, or None if that is the start of the member."""
+        with self._lock:
+            i = bisect.bisect_right(self._positions, pos) - 1
+            if i <= 0:
+                return None
+            compress_pos, decompressor = self._checkpoints[i]
+            return self._positions[i], compress_pos, decompressor.copy()
+
+
 class ZipExtFile(io.BufferedIOBase):
     """File-like object for reading an archive member.
        Is returned by ZipFile.open().
@@ -865,6 +988,8 @@ class ZipExtFile(io.BufferedIOBase):
         self._eof = False
         self._readbuffer = b''
         self._offset = 0
+        # Set by ZipFile.open when a _SeekIndex is kept for this member
+        self._seek_index = None
 
         self.newlines = None
 
@@ -1051,6 +1176,9 @@ class ZipExtFile(io.BufferedIOBase):
 
         # Read from file.
         if self._compress_type == ZIP_DEFLATED:
+            if self._seek_index is not None:
+                n = self._seek_index.limit(self._orig_file_size - self._left,
+                                           max(n, self.MIN_READ_SIZE))
             ## Handle unconsumed data.
             data = self._decompressor.unconsumed_tail
             if n > len(data):
@@ -1061,7 +1189,8 @@ class ZipExtFile(io.BufferedIOBase):
         if self._compress_type == ZIP_STORED:
             self._eof = self._compress_left <= 0
         elif self._compress_type == ZIP_DEFLATED:
-            n = max(n, self.MIN_READ_SIZE)
+            if self._seek_index is None:
+                n = max(n, self.MIN_READ_SIZE)
             data = self._decompressor.decompress(data, n)
             self._eof = (self._decompressor.eof or
                          self._compress_left <= 0 and
@@ -1077,6 +1206,12 @@ class ZipExtFile(io.BufferedIOBase):
         if self._left <= 0:
             self._eof = True
         self._update_crc(data)
+        if (self._seek_index is not None and not self._eof and
+                self._compress_type == ZIP_DEFLATED):
+            self._seek_index.record(
+                self._orig_file_size - self._left,
+                self._orig_compress_size - self._compress_left,
+                self._decompressor)
         return data
 
     def _read2(self, n):
@@ -1132,10 +1267,29 @@ class ZipExtFile(io.BufferedIOBase):
         read_offset = new_pos - curr_pos
         buff_offset = read_offset + self._offset
 
+        checkpoint = None
+        if self._seek_index is not None and self._decrypter is None:
+            checkpoint = self._seek_index.find(new_pos)
+            if checkpoint is not None and read_offset >= 0 and checkpoint[0] <= curr_pos:
+                # Reading forward from here is closer
+                checkpoint = None
+
         if buff_offset >= 0 and buff_offset < len(self._readbuffer):
             # Just move the _offset index if the new position is in the _readbuffer
             self._offset = buff_offset
             read_offset = 0
+        elif checkpoint is not None:
+            # Resume decompression at the nearest indexed checkpoint
+            pos, compress_pos, self._decompressor = checkpoint
+            self._fileobj.seek(self._orig_compress_start + compress_pos)
+            # CRC checking is only possible when reading from the start
+            self._expected_crc = None
+            self._compress_left = self._orig_compress_size - compress_pos
+            self._left = self._orig_file_size - pos
+            self._readbuffer = b''
+            self._offset = 0
+            self._eof = False
+            read_offset = new_pos - pos
         # Fast seek uncompressed unencrypted file
         elif self._compress_type == ZIP_STORED and self._decrypter is None:
             # disable CRC checking after first seeking - it would be invalid
@@ -1286,6 +1440,10 @@ class ZipFile:
                    When using ZIP_STORED or ZIP_LZMA this keyword has no effect.
                    When using ZIP_DEFLATED integers 0 through 9 are accepted.
                    When using ZIP_BZIP2 integers 1 through 9 are accepted.
+    seek_index_interval: None (default) or a number of bytes. When set, reading
+                         a ZIP_DEFLATED member records a decompressor checkpoint
+                         every that many bytes, which later seeks in the member
+                         resume from instead of decompressing from its start.
 
     """
 
@@ -1293,7 +1451,8 @@ class ZipFile:
     _windows_illegal_name_trans_table = None
 
     def __init__(self, file, mode="r", compression=ZIP_STORED, allowZip64=True,
-                 compresslevel=None, *, strict_timestamps=True, metadata_encoding=None):
+                 compresslevel=None, *, strict_timestamps=True, metadata_encoding=None,
+                 seek_index_interval=None):
         """Open the ZIP file with mode read 'r', write 'w', exclusive create 'x',
         or append 'a'."""
         if mode not in ('r', 'w', 'x', 'a'):
@@ -1313,6 +1472,8 @@ class ZipFile:
         self._comment = b''
         self._strict_timestamps = strict_timestamps
         self.metadata_encoding = metadata_encoding
+        self._seek_index_interval = seek_index_interval
+        self._seek_indexes = {}
 
         # Check that we don't try to write with nonconforming codecs
         if self.metadata_encoding and mode != 'r':
@@ -1616,8 +1777,9 @@ class ZipFile:
 
         # Open for reading:
         self._fileRefCnt += 1
-        zef_file = _SharedFile(self.fp, zinfo.header_offset,
-                               self._fpclose, self._lock, lambda: self._writing)
+        zef_file = _shared_file(self.fp, zinfo.header_offset,
+                                self._fpclose, self._lock, lambda: self._writing,
+                                self.mode == 'r')
         try:
             # Skip the file header:
             fheader = zef_file.read(sizeFileHeader)
@@ -1667,7 +1829,12 @@ class ZipFile:
             else:
                 pwd = None
 
-            return ZipExtFile(zef_file, mode, zinfo, pwd, True)
+            zef = ZipExtFile(zef_file, mode, zinfo, pwd, True)
+            if (self._seek_index_interval and zef._seekable and
+                    zinfo.compress_type == ZIP_DEFLATED and not is_encrypted):
+                zef._seek_index = self._seek_indexes.setdefault(
+                    zinfo.header_offset, _SeekIndex(self._seek_index_interval))
+            return zef
         except:
             zef_file.close()
             raise
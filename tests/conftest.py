@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+import synthetic  # noqa: E402
+from payload_dumper import update_metadata_pb2 as um  # noqa: E402
+from payload_dumper.dumper import u32, u64  # noqa: E402
+
+BLOCK_SIZE = 4096
+
+
+def read_manifest(path):
+    with open(path, "rb") as f:
+        head = f.read(24)
+        manifest = f.read(u64(head[12:20]))
+        f.read(u32(head[20:24]))
+        data_offset = f.tell()
+    dam = um.DeltaArchiveManifest()
+    dam.ParseFromString(manifest)
+    return dam, data_offset
+
+
+@pytest.fixture(scope="session")
+def payload(tmp_path_factory):
+    """A small differential payload with every operation type.
+
+    product ends with a hash tree and FEC area, as verity partitions do.
+    """
+    directory = tmp_path_factory.mktemp("payload")
+    summary = synthetic.generate(
+        str(directory / "payload.bin"),
+        {
+            "system": 96 * BLOCK_SIZE,
+            "vendor": 40 * BLOCK_SIZE,
+            "product": 72 * BLOCK_SIZE,
+        },
+        dict.fromkeys(synthetic.OP_TYPES, 1),
+        block_size=BLOCK_SIZE,
+        op_blocks=8,
+        old_dir=str(directory / "old"),
+        seed=1,
+        verity=("product",),
+    )
+    summary["dir"] = directory
+    summary["old_dir"] = str(directory / "old")
+    summary["manifest"], summary["data_offset"] = read_manifest(summary["path"])
+    return summary
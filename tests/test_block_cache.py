@@ -0,0 +1,42 @@
+import os
+
+from payload_dumper import block_cache
+from payload_dumper.block_cache import BlockCache
+
+
+def test_put_get(tmp_path):
+    cache = BlockCache(str(tmp_path), block_size=4)
+    key = cache.key("http://example.com/ota.zip", '"v1"', 10)
+    cache.put(key, 1, b"abcd")
+    assert cache.get(key, 1, 4) == b"abcd"
+    # A short or missing block is a miss
+    assert cache.get(key, 1, 2) is None
+    assert cache.get(key, 2, 4) is None
+    assert cache.key("http://example.com/ota.zip", '"v2"', 10) != key
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = BlockCache(str(tmp_path), max_size=8, block_size=4)
+    key = cache.key("http://example.com/ota.zip", '"v1"', 12)
+    for index in range(3):
+        cache.put(key, index, b"abcd")
+        path = os.path.join(str(tmp_path), key, str(index))
+        os.utime(path, (index, index))
+    cache.evict()
+    assert cache.get(key, 0, 4) is None
+    assert cache.get(key, 1, 4) == b"abcd"
+    assert cache.get(key, 2, 4) == b"abcd"
+
+
+def test_put_failure_is_ignored(tmp_path, monkeypatch):
+    cache = BlockCache(str(tmp_path), block_size=4)
+    key = cache.key("http://example.com/ota.zip", '"v1"', 4)
+
+    def replace(src, dst):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(block_cache.os, "replace", replace)
+    cache.put(key, 0, b"abcd")
+    assert cache.get(key, 0, 4) is None
+    # The temporary file is gone too
+    assert os.listdir(os.path.join(str(tmp_path), key)) == []
@@ -0,0 +1,144 @@
+import functools
+import random
+import threading
+
+import httpx
+import pytest
+import synthetic
+from range_server import RangeServer
+
+from payload_dumper import http_file
+from payload_dumper.block_cache import BlockCache
+from payload_dumper.dumper import Dumper
+from payload_dumper.http_file import HttpFile
+from payload_dumper.range_planner import DEFAULT_MAX_GAP, plan_ranges
+
+SIZE = 1024 * 1024
+DATA = synthetic.random_bytes(random.Random(0), SIZE)
+CACHE_BLOCK = 64 * 1024
+
+
+@pytest.fixture
+def root(tmp_path):
+    directory = tmp_path / "www"
+    directory.mkdir()
+    with open(directory / "file.bin", "wb") as f:
+        f.write(DATA)
+    return str(directory)
+
+
+def test_coalescing_saves_requests(payload, tmp_path):
+    items = [
+        (partition, op)
+        for partition in payload["manifest"].partitions
+        for op in partition.operations
+    ]
+    with_data = sum(1 for _, op in items if op.data_length > 0)
+    spans = plan_ranges(items, payload["data_offset"], max_gap=DEFAULT_MAX_GAP)
+    assert len(spans) < with_data
+
+    requests = {}
+    with RangeServer(str(payload["dir"])) as server:
+        for gap in (-1, DEFAULT_MAX_GAP):
+            out = tmp_path / f"out{gap}"
+            out.mkdir()
+            server.reset_stats()
+            with HttpFile(server.url + "payload.bin") as f:
+                dumper = Dumper(
+                    f,
+                    str(out),
+                    diff=True,
+                    old=payload["old_dir"],
+                    workers=2,
+                    coalesce_gap=gap,
+                )
+                dumper.run()
+            assert not dumper.failed
+            requests[gap] = server.stats()["requests"]
+    # Reading the manifest takes the same requests either way
+    assert requests[-1] - requests[DEFAULT_MAX_GAP] == with_data - len(spans)
+
+
+def test_cache_hits_on_second_read(root, tmp_path):
+    cache = BlockCache(str(tmp_path / "cache"), block_size=CACHE_BLOCK)
+    with RangeServer(root) as server:
+        with HttpFile(server.url + "file.bin", cache=cache) as f:
+            assert f.read_at(1000, 200000) == DATA[1000:201000]
+            requests = server.stats()["requests"]
+            assert f.read_at(1000, 200000) == DATA[1000:201000]
+            assert server.stats()["requests"] == requests
+            stats = f.stats()
+        assert stats["cache_misses"] == 4
+        assert stats["cache_hits"] == 4
+
+        # Shared with another reader of the same file version
+        server.reset_stats()
+        with HttpFile(server.url + "file.bin", cache=cache) as f:
+            assert f.read_at(CACHE_BLOCK, 1000) == DATA[CACHE_BLOCK : CACHE_BLOCK + 1000]
+            assert f.stats()["cache_hits"] == 1
+        assert server.stats()["requests"] == 0
+
+
+def test_refresh_replaces_cached_blocks(root, tmp_path):
+    cache = BlockCache(str(tmp_path / "cache"), block_size=CACHE_BLOCK)
+    with RangeServer(root) as server:
+        with HttpFile(server.url + "file.bin", cache=cache) as f:
+            f.read_at(0, 1000)
+            # A corrupt block is served until it is refreshed
+            cache.put(f.cache_key, 0, bytes(CACHE_BLOCK))
+            assert f.read_at(0, 1000) == bytes(1000)
+            assert f.read_at(0, 1000, refresh=True) == DATA[:1000]
+            assert cache.get(f.cache_key, 0, CACHE_BLOCK) == DATA[:CACHE_BLOCK]
+            assert f.read_at(0, 1000) == DATA[:1000]
+
+
+def test_remote_without_ranges(root):
+    with RangeServer(root, accept_ranges=False) as server:
+        with pytest.raises(ValueError, match="ranges"):
+            HttpFile(server.url + "file.bin")
+        assert server.stats()["requests"] == 0
+
+
+def test_resumes_reset_responses(root):
+    chunk = 128 * 1024
+    with RangeServer(root, reset_every=2) as server:
+        with HttpFile(server.url + "file.bin", connections=1) as f:
+            for offset in range(0, SIZE, chunk):
+                assert f.read_at(offset, chunk) == DATA[offset : offset + chunk]
+            stats = f.stats()
+        server_stats = server.stats()
+    assert server_stats["resets"] > 0
+    assert stats["retries"] == server_stats["resets"]
+    assert stats["total_bytes"] == SIZE
+
+
+def test_more_readers_than_connections(root, monkeypatch):
+    # Readers waiting for one of the connections must not hit the pool timeout
+    monkeypatch.setattr(
+        http_file.httpx,
+        "Client",
+        functools.partial(httpx.Client, timeout=httpx.Timeout(5.0, pool=0.1)),
+    )
+    chunk = SIZE // 4
+    errors = []
+
+    def read(f, offset):
+        try:
+            assert f.read_at(offset, chunk) == DATA[offset : offset + chunk]
+        except Exception as exc:
+            errors.append(exc)
+
+    with RangeServer(root, bandwidth=2 * 1024 * 1024) as server:
+        with HttpFile(server.url + "file.bin", connections=2) as f:
+            threads = [
+                threading.Thread(target=read, args=(f, offset))
+                for offset in range(0, SIZE, chunk)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # Not even retried after a pool timeout
+            assert f.stats()["retries"] == 0
+        assert server.stats()["requests"] == 4
+    assert errors == []
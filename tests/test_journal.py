@@ -0,0 +1,65 @@
+from payload_dumper.journal import JOURNAL_NAME, Journal
+
+
+def test_load_completed_operations(tmp_path):
+    journal = Journal(str(tmp_path), "abc")
+    journal.start()
+    journal.record("system", 0)
+    journal.record("system", 3)
+    journal.record("vendor", 1)
+    journal.close()
+
+    journal = Journal(str(tmp_path), "abc")
+    journal.load()
+    assert journal.completed("system") == {0, 3}
+    assert journal.completed("vendor") == {1}
+    assert journal.completed("boot") == set()
+
+
+def test_load_ignores_other_manifest(tmp_path):
+    (tmp_path / JOURNAL_NAME).write_text("manifest other\nsystem 0\n")
+    journal = Journal(str(tmp_path), "abc")
+    journal.load()
+    assert journal.done == {}
+
+
+def test_load_drops_torn_lines(tmp_path):
+    (tmp_path / JOURNAL_NAME).write_text(
+        "manifest abc\nsystem 0\nmy part 2\nsystem x\nsystem 1"
+    )
+    journal = Journal(str(tmp_path), "abc")
+    journal.load()
+    assert journal.completed("system") == {0, 1}
+    assert journal.completed("my part") == {2}
+
+    (tmp_path / JOURNAL_NAME).write_text("manifest abc\nsystem 0\nsyst")
+    journal = Journal(str(tmp_path), "abc")
+    journal.load()
+    assert journal.done == {"system": {0}}
+
+
+def test_load_missing_journal(tmp_path):
+    journal = Journal(str(tmp_path), "abc")
+    journal.load()
+    assert journal.done == {}
+
+
+def test_reset_while_appending(tmp_path):
+    journal = Journal(str(tmp_path), "abc")
+    journal.start()
+    journal.record("system", 0)
+    journal.record("vendor", 0)
+    journal.reset("system")
+    journal.record("vendor", 1)
+    journal.close()
+
+    journal = Journal(str(tmp_path), "abc")
+    journal.load()
+    assert journal.done == {"vendor": {0, 1}}
+
+
+def test_close_remove(tmp_path):
+    journal = Journal(str(tmp_path), "abc")
+    journal.start()
+    journal.close(remove=True)
+    assert not (tmp_path / JOURNAL_NAME).exists()
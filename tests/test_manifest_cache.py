@@ -0,0 +1,37 @@
+import os
+
+from payload_dumper.manifest_cache import ManifestCache
+
+
+class Remote:
+    def __init__(self, url, etag='"v1"', size=1000):
+        self.url = url
+        self.etag = etag
+        self.size = size
+
+
+def test_put_get(tmp_path):
+    cache = ManifestCache(str(tmp_path))
+    source = Remote("http://example.com/ota.zip")
+    assert cache.get(source) is None
+    cache.put(source, b"manifest", b"signature", 100, 200)
+    assert cache.get(source) == (b"manifest", b"signature", 100, 200)
+    # Another version of the file, or a remote without an ETag
+    assert cache.get(Remote("http://example.com/ota.zip", etag='"v2"')) is None
+    cache.put(Remote("http://example.com/new.zip", etag=""), b"m", b"s", 0, 0)
+    assert len(os.listdir(str(tmp_path))) == 1
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ManifestCache(str(tmp_path), max_size=2500)
+    sources = [Remote(f"http://example.com/{i}.zip") for i in range(3)]
+    for i, source in enumerate(sources[:2]):
+        cache.put(source, bytes(1000), b"", 0, 0)
+        path = os.path.join(str(tmp_path), cache.key(source))
+        os.utime(path, (i, i))
+    # A hit makes the oldest entry the most recently used
+    assert cache.get(sources[0]) is not None
+    cache.put(sources[2], bytes(1000), b"", 0, 0)
+    assert cache.get(sources[1]) is None
+    assert cache.get(sources[0]) is not None
+    assert cache.get(sources[2]) is not None
@@ -0,0 +1,49 @@
+import hashlib
+import os
+from types import SimpleNamespace
+
+from payload_dumper.operations import OperationDecoder
+from payload_dumper.tracing import NULL_TRACER
+
+
+class Decoder(OperationDecoder):
+    block_size = 10
+    diff = True
+    tracer = NULL_TRACER
+
+
+def extents(*pairs):
+    return [SimpleNamespace(start_block=start, num_blocks=n) for start, n in pairs]
+
+
+def test_pair_extents_splits_at_both_boundaries():
+    src = extents((0, 3), (10, 2))
+    dst = extents((5, 1), (20, 4))
+    pairs = list(Decoder().pair_extents(src, dst))
+    assert pairs == [(0, 50, 10), (10, 200, 20), (100, 220, 20)]
+
+
+def test_pair_extents_same_layout():
+    pairs = list(Decoder().pair_extents(extents((4, 2)), extents((8, 2))))
+    assert pairs == [(40, 80, 20)]
+
+
+def test_pair_extents_stops_at_end_of_destination():
+    pairs = list(Decoder().pair_extents(extents((0, 5)), extents((10, 2))))
+    assert pairs == [(0, 100, 20)]
+
+
+def test_dump_payload(payload, tmp_path, capsys):
+    from payload_dumper.dumper import Dumper
+
+    with open(payload["path"], "rb") as f:
+        dumper = Dumper(f, str(tmp_path), diff=True, old=payload["old_dir"], workers=2)
+        dumper.run()
+    assert not dumper.failed
+    # The hash tree and FEC are left to the device: no whole-image check there
+    out = capsys.readouterr().out
+    assert "product - has verity data" in out
+    assert "hash mismatch" not in out
+    for name, expected in payload["partitions"].items():
+        with open(os.path.join(tmp_path, name + ".img"), "rb") as image:
+            assert hashlib.sha256(image.read()).hexdigest() == expected
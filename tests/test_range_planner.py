@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+from payload_dumper.range_planner import plan_ranges
+
+
+def op(data_offset, data_length):
+    return SimpleNamespace(data_offset=data_offset, data_length=data_length)
+
+
+def test_spans_cover_every_operation_with_data(payload):
+    items = [
+        (partition, op)
+        for partition in payload["manifest"].partitions
+        for op in partition.operations
+    ]
+    spans = plan_ranges(items, payload["data_offset"])
+    planned = [id(op) for span in spans for _, op in span.items]
+    with_data = [id(op) for _, op in items if op.data_length > 0]
+    assert sorted(planned) == sorted(with_data)
+    for span in spans:
+        assert span.remaining == len(span.items)
+        for _, op in span.items:
+            start = payload["data_offset"] + op.data_offset
+            assert span.start <= start
+            assert start + op.data_length <= span.end
+    for prev, span in zip(spans, spans[1:]):
+        assert prev.end <= span.start
+
+
+def test_gap_and_max_size():
+    items = [(None, op(0, 10)), (None, op(15, 10)), (None, op(100, 10))]
+    spans = plan_ranges(items, 1000, max_gap=5)
+    assert [(span.start, span.end) for span in spans] == [(1000, 1025), (1100, 1110)]
+
+    spans = plan_ranges(items, 0, max_gap=1000, max_size=50)
+    assert [(span.start, span.end) for span in spans] == [(0, 25), (100, 110)]
+
+
+def test_negative_gap_gives_every_operation_a_span():
+    items = [(None, op(0, 10)), (None, op(10, 10)), (None, op(20, 0))]
+    spans = plan_ranges(items, 0, max_gap=-1)
+    assert [(span.start, span.end) for span in spans] == [(0, 10), (10, 20)]
+
+
+def test_span_is_read_once_and_dropped_when_consumed():
+    items = [(None, op(0, 4)), (None, op(6, 4))]
+    (span,) = plan_ranges(items, 0)
+    reads = []
+
+    def reader(offset, length):
+        reads.append((offset, length))
+        return b"0123456789"[offset : offset + length]
+
+    assert span.read(reader, 6, 4) == b"6789"
+    assert span.data is not None
+    assert span.read(reader, 0, 4) == b"0123"
+    assert reads == [(0, 10)]
+    assert span.data is None
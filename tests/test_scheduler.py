@@ -0,0 +1,66 @@
+import json
+
+import synthetic
+from conftest import BLOCK_SIZE
+from payload_dumper import dumper as dumper_module
+from payload_dumper.range_planner import plan_ranges
+from payload_dumper.scheduler import schedule
+from payload_dumper.stream_hash import ReorderBudget
+
+
+def parts_of(manifest):
+    return [
+        {"partition": partition, "operations": list(partition.operations)}
+        for partition in manifest.partitions
+    ]
+
+
+def start_blocks(queue, part):
+    return [op.dst_extents[0].start_block for owner, op in queue if owner is part]
+
+
+def test_schedule_keeps_write_order_within_partitions(payload):
+    parts = parts_of(payload["manifest"])
+    queue = schedule(parts, BLOCK_SIZE)
+    assert len(queue) == sum(len(part["operations"]) for part in parts)
+    for part in parts:
+        blocks = start_blocks(queue, part)
+        assert blocks == sorted(blocks)
+    # Partitions are not interleaved, the most expensive one comes first
+    owners = [owner["partition"].partition_name for owner, _ in queue]
+    assert owners[0] == "system"
+    assert sum(1 for a, b in zip(owners, owners[1:]) if a != b) == len(parts) - 1
+
+
+def test_schedule_keeps_spans_together(payload):
+    parts = parts_of(payload["manifest"])
+    items = [(part, op) for part in parts for op in part["operations"]]
+    spans = plan_ranges(items, payload["data_offset"], max_gap=BLOCK_SIZE)
+    queue = schedule(parts, BLOCK_SIZE, spans)
+    position = {id(op): i for i, (_, op) in enumerate(queue)}
+    for span in spans:
+        indices = sorted(position[id(op)] for _, op in span.items)
+        assert indices == list(range(indices[0], indices[0] + len(indices)))
+
+
+def test_hash_read_back_stays_small(tmp_path, monkeypatch):
+    # Larger than the reorder buffer, with no copies that must be read back
+    summary = synthetic.generate(
+        str(tmp_path / "payload.bin"),
+        {"system": 512 * BLOCK_SIZE},
+        {"REPLACE": 1, "REPLACE_XZ": 1, "REPLACE_BZ": 1, "ZERO": 1},
+        block_size=BLOCK_SIZE,
+        op_blocks=4,
+        seed=2,
+    )
+    monkeypatch.setattr(
+        dumper_module, "ReorderBudget", lambda: ReorderBudget(128 * BLOCK_SIZE)
+    )
+    report = tmp_path / "report.json"
+    with open(summary["path"], "rb") as f:
+        dumper = dumper_module.Dumper(f, str(tmp_path), workers=4, report=str(report))
+        dumper.run()
+    assert not dumper.failed
+    with open(report) as f:
+        (partition,) = json.load(f)["partitions"]
+    assert partition["hash_read_back_bytes"] <= 16 * BLOCK_SIZE
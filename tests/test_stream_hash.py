@@ -0,0 +1,90 @@
+import hashlib
+import os
+
+import pytest
+
+from payload_dumper.image_file import ImageFile
+from payload_dumper.stream_hash import ReorderBudget, StreamHasher
+
+SIZE = 64 * 1024
+CHUNK = 4096
+
+
+@pytest.fixture
+def content():
+    return os.urandom(SIZE)
+
+
+@pytest.fixture
+def image(tmp_path):
+    image = ImageFile(str(tmp_path / "image.img"), "wb")
+    image.truncate(SIZE)
+    yield image
+    image.close()
+
+
+def write(image, hasher, offset, data):
+    image._write(offset, memoryview(data))
+    hasher.update(offset, data)
+
+
+def chunks(order):
+    return [i * CHUNK for i in order]
+
+
+def test_out_of_order_writes(image, content):
+    budget = ReorderBudget()
+    hasher = StreamHasher(image, SIZE, hashlib.sha256(content).digest(), budget)
+    for offset in reversed(chunks(range(1, SIZE // CHUNK))):
+        write(image, hasher, offset, content[offset : offset + CHUNK])
+    assert budget.used == SIZE - CHUNK
+    write(image, hasher, 0, content[:CHUNK])
+    assert budget.used == 0
+    assert hasher.finish()
+    assert budget.used == 0
+
+
+def test_shared_budget_overflow_is_read_back(image, content):
+    # Two hashers share room for three chunks; the rest is read from the image
+    budget = ReorderBudget(3 * CHUNK)
+    other = StreamHasher(image, SIZE, b"", budget)
+    other.update(CHUNK, b"x" * CHUNK)
+    hasher = StreamHasher(image, SIZE, hashlib.sha256(content).digest(), budget)
+    for offset in chunks(range(SIZE // CHUNK - 1, 0, -1)):
+        write(image, hasher, offset, content[offset : offset + CHUNK])
+    assert hasher.buffered == 2 * CHUNK
+    assert budget.used == budget.limit
+    write(image, hasher, 0, content[:CHUNK])
+    assert hasher.finish()
+    other.release()
+    assert budget.used == 0
+
+
+def test_zero_written_and_unwritten_ranges(image, content):
+    content = bytearray(content)
+    content[0:CHUNK] = bytes(CHUNK)
+    image._write(2 * CHUNK, memoryview(content[2 * CHUNK : 3 * CHUNK]))
+    image._write(4 * CHUNK, memoryview(content[4 * CHUNK :]))
+    hasher = StreamHasher(image, SIZE, hashlib.sha256(content).digest())
+    write(image, hasher, CHUNK, content[CHUNK : 2 * CHUNK])
+    hasher.zero(0, CHUNK)
+    # Written around the hasher (copy_file_range), and never written this run
+    hasher.written(2 * CHUNK, CHUNK)
+    write(image, hasher, 3 * CHUNK, content[3 * CHUNK : 4 * CHUNK])
+    assert hasher.finish()
+
+
+def test_rewritten_range_is_rehashed(image, content):
+    hasher = StreamHasher(image, SIZE, hashlib.sha256(content).digest())
+    write(image, hasher, 0, b"bad" * 100)
+    write(image, hasher, CHUNK, content[CHUNK : 2 * CHUNK])
+    write(image, hasher, 0, content[:CHUNK])
+    image._write(2 * CHUNK, memoryview(content[2 * CHUNK :]))
+    assert hasher.finish()
+
+
+def test_mismatch(image, content):
+    image._write(0, memoryview(content))
+    hasher = StreamHasher(image, SIZE, hashlib.sha256(b"other").digest())
+    hasher.update(0, content)
+    assert not hasher.finish()
@@ -0,0 +1,60 @@
+import random
+import zipfile as stdzip
+
+import pytest
+
+from payload_dumper import zipfile
+
+INTERVAL = 8 * 1024
+
+
+@pytest.fixture(scope="module")
+def deflated(payload):
+    # The generated payload, deflated into a zip
+    with open(payload["path"], "rb") as f:
+        data = f.read()
+    path = payload["dir"] / "deflated.zip"
+    with stdzip.ZipFile(path, "w") as z:
+        z.writestr("payload.bin", data, compress_type=stdzip.ZIP_DEFLATED)
+    return path, data
+
+
+def seek_index(zip_file):
+    return zip_file._seek_indexes[zip_file.getinfo("payload.bin").header_offset]
+
+
+def test_checkpoints_every_interval(deflated):
+    path, data = deflated
+    with zipfile.ZipFile(path, seek_index_interval=INTERVAL) as z:
+        with z.open("payload.bin") as member:
+            # A single large read, as a seek does
+            member.seek(len(data) - 1)
+            assert member.read() == data[-1:]
+        positions = seek_index(z)._positions
+    assert positions == list(range(0, len(data), INTERVAL))[: len(positions)]
+    assert len(positions) == (len(data) - 1) // INTERVAL + 1
+
+
+def test_limit_and_find():
+    index = zipfile._SeekIndex(INTERVAL)
+    assert index.find(10) is None
+    assert index.limit(100, 1 << 20) == INTERVAL - 100
+    assert index.limit(100, 10) == 10
+
+
+def test_seek_from_checkpoints(deflated):
+    path, data = deflated
+    rnd = random.Random(0)
+    with zipfile.ZipFile(path, seek_index_interval=INTERVAL) as z:
+        with z.open("payload.bin") as member:
+            assert member.read() == data
+        assert len(seek_index(z)._positions) > 1
+        with z.open("payload.bin") as member:
+            for _ in range(50):
+                pos = rnd.randrange(len(data))
+                n = rnd.randrange(1, 3 * INTERVAL)
+                member.seek(pos)
+                assert member.tell() == pos
+                assert member.read(n) == data[pos : pos + n]
+            member.seek(0)
+            assert member.read() == data